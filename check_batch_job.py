@@ -2,6 +2,7 @@ from google import genai
 from google.genai import types
 from pathlib import Path
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import json
 import time
 import os
@@ -10,6 +11,12 @@ from dotenv import load_dotenv
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 
+# Poll interval bounds in seconds. The interval grows while the job stays in the same
+# state and drops back to the initial value whenever the state changes.
+POLL_INITIAL_DELAY = 10
+POLL_MAX_DELAY = 600
+POLL_BACKOFF_FACTOR = 1.5
+
 def check_batch_job(batch_job_info_file, batch_input_file_info_file, output_directory, client):
     
     # Load batch job info
@@ -33,13 +40,19 @@ def check_batch_job(batch_job_info_file, batch_input_file_info_file, output_dire
     
     print(f"Polling status for job: {batch_job_name}")
 
-    # Poll the job status until it's completed.
+    # Poll the job status until it's completed, backing off while nothing changes.
+    delay = POLL_INITIAL_DELAY
+    previous_state = None
     while True:
         batch_job = client.batches.get(name=batch_job_name)
         if batch_job.state.name in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED'):
             break
-        print(f"Job not finished. Current state: {batch_job.state.name}. Waiting 10 minutes...")
-        time.sleep(600)  # Wait for 10 minutes before polling again
+        if batch_job.state.name != previous_state:
+            delay = POLL_INITIAL_DELAY
+            previous_state = batch_job.state.name
+        print(f"Job not finished. Current state: {batch_job.state.name}. Waiting {delay:.0f} seconds...")
+        time.sleep(delay)
+        delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
 
     print(f"Job finished with state: {batch_job.state.name}")
     if batch_job.state.name == 'JOB_STATE_FAILED':
@@ -76,17 +89,48 @@ def check_batch_job(batch_job_info_file, batch_input_file_info_file, output_dire
         fp.write(batch_job_info)
 
 
-if __name__ == "__main__":
+def check_batch_job_directories(batch_job_directories, client):
+    # Each directory holds the info files written by create_batch_job.py and receives its own results.
+    # Polling mostly sleeps, so all jobs are monitored from threads in this one process.
+    with ThreadPoolExecutor(max_workers=len(batch_job_directories)) as executor:
+        futures = [
+            executor.submit(
+                check_batch_job,
+                directory / "batch_job_info.json",
+                directory / "batch_input_file_info.json",
+                directory,
+                client
+            )
+            for directory in batch_job_directories
+        ]
+        for future in futures:
+            future.result()
+
+
+def main(argv=None):
     
     parser = argparse.ArgumentParser(description="Check status of batch job.")
-    parser.add_argument("batch_job_info_file", type=Path, help="Path to a batch info file")
-    parser.add_argument("batch_input_file_info_file", type=Path, help="Path to a batch input file info file")
-    parser.add_argument("output_directory", type=Path, help="Path to the output directory")
+    parser.add_argument("batch_job_info_file", type=Path, nargs="?", help="Path to a batch info file")
+    parser.add_argument("batch_input_file_info_file", type=Path, nargs="?", help="Path to a batch input file info file")
+    parser.add_argument("output_directory", type=Path, nargs="?", help="Path to the output directory")
+    parser.add_argument("--batch_job_directories", type=Path, nargs="+", help="Batch job directories to monitor together, instead of the single job given by the positional arguments")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    single_job_args = (args.batch_job_info_file, args.batch_input_file_info_file, args.output_directory)
+    if args.batch_job_directories:
+        if any(single_job_args):
+            parser.error("Use either the positional arguments or --batch_job_directories, not both")
+    elif not all(single_job_args):
+        parser.error("batch_job_info_file, batch_input_file_info_file and output_directory are required without --batch_job_directories")
 
     client = genai.Client(api_key=API_KEY)
 
-    check_batch_job(args.batch_job_info_file, args.batch_input_file_info_file, args.output_directory, client)
+    if args.batch_job_directories:
+        check_batch_job_directories(args.batch_job_directories, client)
+    else:
+        check_batch_job(args.batch_job_info_file, args.batch_input_file_info_file, args.output_directory, client)
+
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()
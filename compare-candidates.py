@@ -1,9 +1,17 @@
 import argparse
+import importlib.util
 import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import orjson
 import requests
 import pandas as pd
 from pydantic import BaseModel, Field
+import kortkat
 
 class ComparisonResponseSchema(BaseModel):
     result: str = Field(description="Indicates whether a correct match was found: 'one' or 'none'")
@@ -11,7 +19,94 @@ class ComparisonResponseSchema(BaseModel):
     reason: str = Field(description="A very short description of the reason for the assessment")
 
 
-def build_request(prompt_parts, generation_config):
+# The response schema is the same for every request, generate it once at import
+COMPARISON_RESPONSE_JSON_SCHEMA = ComparisonResponseSchema.model_json_schema()
+
+# Columns of the matches sheet used to pick candidates, the rest is never read
+MATCHES_COLUMNS = ['match_object_ID', 'matched_ID', 'similarity']
+
+# The Rust-based calamine reader is much faster than openpyxl, use it when it is installed
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
+
+# Number of Libris API requests allowed in flight at the same time
+LIBRIS_MAX_WORKERS = 16
+
+LIBRIS_XSEARCH_URL = "https://libris.kb.se/xsearch"
+LIBRIS_DATA_DIRECTORY = Path("jobs/libris_data")
+MARC_NAMESPACE = "http://www.loc.gov/MARC21/slim"
+
+# MARC datafields that describe the edition, everything else is dropped from the prompt
+PROMPT_MARC_TAGS = {
+    "020", "041", "100", "110", "111", "130", "240", "245", "246", "250",
+    "260", "264", "300", "490", "700", "710", "711", "800", "830"
+}
+
+# Number of Libris IDs combined into a single OR query
+LIBRIS_BATCH_SIZE = 20
+
+# Rate limit and retry policy for the Libris xsearch API
+LIBRIS_REQUESTS_PER_SECOND = 10
+LIBRIS_MAX_RETRIES = 5
+LIBRIS_MAX_BACKOFF_SECONDS = 30
+LIBRIS_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that spaces out requests to a fixed rate per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+libris_rate_limiter = TokenBucket(LIBRIS_REQUESTS_PER_SECOND)
+
+# One keep-alive session shared by all worker threads, so connections and TLS sessions are reused.
+# The pool is sized to the worker count so no thread has to open a throwaway connection.
+libris_session = requests.Session()
+libris_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=LIBRIS_MAX_WORKERS))
+
+# Serialize split MARC records without an ns0: prefix on every element
+ET.register_namespace("", MARC_NAMESPACE)
+
+
+def build_request_envelope(generation_config):
+    # Everything except the key and prompt parts is the same for every request in a run,
+    # so it is built once and shared by reference in all requests
+    return {
+        "systemInstruction": {
+            "parts": [{"text": generation_config["system_instruction"]}]
+        },
+        "generationConfig": {
+            "temperature": generation_config["temperature"],
+            "topP": generation_config["top_p"],
+            "topK": generation_config["top_k"],
+            "maxOutputTokens": generation_config["max_output_tokens"],
+            "responseMimeType": generation_config["response_mime_type"],
+            "thinkingConfig": {
+                "thinkingBudget": generation_config["thinking_budget"]
+            },
+            "responseJsonSchema": COMPARISON_RESPONSE_JSON_SCHEMA
+        }
+    }
+
+
+def build_request(prompt_parts, request_envelope):
 
     request_contents_parts = []
 
@@ -30,20 +125,7 @@ def build_request(prompt_parts, generation_config):
                     "role": "user",
                     "parts": request_contents_parts
             }],
-            "systemInstruction": {
-                "parts": [{"text": generation_config["system_instruction"]}]
-            },
-            "generationConfig": {
-                "temperature": generation_config["temperature"],
-                "topP": generation_config["top_p"],
-                "topK": generation_config["top_k"],
-                "maxOutputTokens": generation_config["max_output_tokens"],
-                "responseMimeType": generation_config["response_mime_type"],
-                "thinkingConfig": {
-                    "thinkingBudget": generation_config["thinking_budget"]
-                },
-                "responseJsonSchema": ComparisonResponseSchema.model_json_schema()
-            }
+            **request_envelope
         }
     }
 
@@ -57,11 +139,13 @@ def build_input_file_contents(prompt_contents, output_directory, generation_conf
 
     total_requests = 0
 
-    for i, prompt_parts in enumerate(prompt_contents):
-        request = build_request(prompt_parts, generation_config)
-        with output_file_path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(request) + "\n")
-        total_requests += 1
+    request_envelope = build_request_envelope(generation_config)
+
+    with output_file_path.open("wb", buffering=1 << 20) as f:
+        for prompt_parts in prompt_contents:
+            request = build_request(prompt_parts, request_envelope)
+            f.write(orjson.dumps(request) + b"\n")
+            total_requests += 1
 
     if total_requests == 0:
        print("❌ No requests were processed. Please check the input directory and parameters.")
@@ -70,15 +154,130 @@ def build_input_file_contents(prompt_contents, output_directory, generation_conf
        print(f"✅ Successfully wrote batch input file with {total_requests} requests to {output_file_path}")
 
 
+def request_libris(api_url, verbose, params=None):
+    """GET a Libris URL under the shared rate limit, retrying transient failures with exponential backoff."""
+
+    for attempt in range(LIBRIS_MAX_RETRIES + 1):
+        libris_rate_limiter.acquire()
+        try:
+            response = libris_session.get(api_url, params=params, timeout=10)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == LIBRIS_MAX_RETRIES:
+                raise
+            reason, retry_after = e, None
+        else:
+            if response.status_code not in LIBRIS_RETRY_STATUS_CODES or attempt == LIBRIS_MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            reason, retry_after = f"HTTP {response.status_code}", response.headers.get("Retry-After")
+
+        delay = min(LIBRIS_MAX_BACKOFF_SECONDS, 2 ** attempt)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        if verbose:
+            print(f"⚠️  Libris request failed ({reason}), retrying in {delay}s...")
+        time.sleep(delay)
+
+
+def get_libris_xml_path(libris_id):
+    return LIBRIS_DATA_DIRECTORY / f"{libris_id}.xml"
+
+
+def write_libris_xml(libris_id, xml_bytes):
+    # Write to a temporary file and rename it into place, so an interrupted run never
+    # leaves a truncated record that later runs would pick up from the cache
+    xml_file_path = get_libris_xml_path(libris_id)
+    tmp_file_path = xml_file_path.with_suffix(".xml.tmp")
+    tmp_file_path.write_bytes(xml_bytes)
+    os.replace(tmp_file_path, xml_file_path)
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def extract_marc_minimal(xml_text):
+    """Reduce a Libris record to controlfield 001 and the datafields in PROMPT_MARC_TAGS as compact MARC XML."""
+
+    try:
+        root = ET.fromstring(xml_text)
+    except ET.ParseError:
+        return xml_text
+
+    minimal_records = []
+    for record in root.iter():
+        if local_name(record.tag) != "record":
+            continue
+
+        minimal_record = ET.Element("record")
+        for field in record:
+            field_name = local_name(field.tag)
+            tag = field.get("tag")
+            if field_name == "controlfield" and tag == "001":
+                ET.SubElement(minimal_record, "controlfield", tag=tag).text = field.text
+            elif field_name == "datafield" and tag in PROMPT_MARC_TAGS:
+                minimal_field = ET.SubElement(minimal_record, "datafield", field.attrib)
+                for subfield in field:
+                    ET.SubElement(minimal_field, "subfield", subfield.attrib).text = subfield.text
+        minimal_records.append(ET.tostring(minimal_record, encoding="unicode"))
+
+    # Leave anything that is not MARC as it is
+    if not minimal_records:
+        return xml_text
+
+    return "\n".join(minimal_records)
+
+
+def split_libris_records(xml_content):
+    """Split an xsearch response into a dict of record XML strings keyed by the 001 control number."""
+
+    records = {}
+    for element in ET.fromstring(xml_content).iter():
+        if local_name(element.tag) != "record":
+            continue
+        for field in element:
+            if local_name(field.tag) == "controlfield" and field.get("tag") == "001" and field.text:
+                records[field.text.strip()] = ET.tostring(element, encoding="unicode")
+                break
+
+    return records
+
+
+def fetch_libris_batch(libris_ids, verbose):
+    """Fetch several Libris records with a single OR query and cache each of them to disk."""
+
+    params = {
+        "query": " OR ".join(f"ONR:{libris_id}" for libris_id in libris_ids),
+        "format_level": "full",
+        "n": len(libris_ids)
+    }
+    if verbose:
+        print(f"Getting data for {len(libris_ids)} Libris IDs in one request...")
+
+    try:
+        response = request_libris(LIBRIS_XSEARCH_URL, verbose, params)
+        records = split_libris_records(response.content)
+    except (requests.exceptions.RequestException, ET.ParseError) as e:
+        if verbose:
+            print(f"❌ Batch API call failed for Libris IDs {', '.join(map(str, libris_ids))}: {e}")
+        return
+
+    # IDs missing from the response are left uncached and fall back to a single lookup
+    for libris_id in libris_ids:
+        record = records.get(str(libris_id))
+        if record:
+            write_libris_xml(libris_id, record.encode("utf-8"))
+
+
 def get_libris_record(libris_id, verbose):
 
-    api_url = f"https://libris.kb.se/xsearch?query=ONR:{libris_id}&format_level=full"
+    api_url = f"{LIBRIS_XSEARCH_URL}?query=ONR:{libris_id}&format_level=full"
     if verbose:
         print(f"Getting data for Libris ID {libris_id}...")
 
-    Path("jobs/libris_data").mkdir(parents=True, exist_ok=True)
+    LIBRIS_DATA_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
-    xml_file_path = Path(f"jobs/libris_data/{libris_id}.xml")
+    xml_file_path = get_libris_xml_path(libris_id)
     if xml_file_path.exists():
         if verbose:
             print(f"ℹ️  Found existing XML file for Libris ID {libris_id}")
@@ -88,21 +287,18 @@ def get_libris_record(libris_id, verbose):
         if verbose:
             print(f"ℹ️  No existing XML file found for Libris ID {libris_id}, fetching from API...")
         try:
-            response = requests.get(api_url, timeout=10)
-            response.raise_for_status()
-            with xml_file_path.open("w", encoding="utf-8") as xml_file:
-                xml_file.write(response.text)
-            return response.text    
+            response = request_libris(api_url, verbose)
+            # Libris serves UTF-8, store the raw bytes without a decode and re-encode round trip
+            write_libris_xml(libris_id, response.content)
+            return response.content.decode("utf-8", errors="replace")
         except requests.exceptions.RequestException as e:
             if verbose:
                 print(f"❌ API call failed for Libris ID {libris_id}: {e}")
             return None
         
 
-def get_extracted_data(match_object_id, extracted_data_directory, verbose):
+def load_card_data(card_id, extracted_data_directory, verbose):
 
-    card_id, edition_index = match_object_id.rsplit('_', 1)
-    edition_index = int(edition_index)
     json_file_path = Path(f"{extracted_data_directory}/{card_id}.json")
 
     if not json_file_path.exists():
@@ -120,6 +316,28 @@ def get_extracted_data(match_object_id, extracted_data_directory, verbose):
             print(f"❌ Failed to decode JSON for Card ID {card_id}: {e}")
         return None
 
+    return extracted_data
+
+
+def get_extracted_data(match_object_id, extracted_data_directory, verbose, card_cache=None):
+
+    card_id, edition_index = match_object_id.rsplit('_', 1)
+    edition_index = int(edition_index)
+
+    # Editions of the same card share one JSON file, parse it once and reuse it for every edition
+    if card_cache is None:
+        card_data = load_card_data(card_id, extracted_data_directory, verbose)
+    elif card_id in card_cache:
+        card_data = card_cache[card_id]
+    else:
+        card_data = card_cache[card_id] = load_card_data(card_id, extracted_data_directory, verbose)
+
+    if card_data is None:
+        return None
+
+    # Shallow copy, only the editions list is replaced below and the cached card stays intact
+    extracted_data = dict(card_data)
+
     if "editions" not in extracted_data or not isinstance(extracted_data['editions'], list):
         if verbose:
             print(f"ℹ️  Skipping: {card_id} has no 'editions' list.")
@@ -137,40 +355,64 @@ def get_extracted_data(match_object_id, extracted_data_directory, verbose):
     return extracted_data
     
 
-def get_prompt_contents(match_objects_with_candidates, extracted_data_directory, verbose):
+def get_prompt_libris_record(libris_id, verbose):
+    # Only the reduced record is kept in memory until the run is done, not the full xsearch response
+    xml_data = get_libris_record(libris_id, verbose)
+    if xml_data:
+        return extract_marc_minimal(xml_data)
+    return xml_data
 
-    prompt_contents = []
 
-    for candidate in match_objects_with_candidates:
-        match_object_id = candidate['match_object_ID']
-        libris_ids = candidate['libris_IDs']
-        if verbose:
-            print(f"Processing Match Object ID: {match_object_id} with {len(libris_ids)} candidates.")       
+def get_prompt_contents(match_objects_with_candidates, extracted_data_directory, verbose):
+    """Yield the prompt parts of one match object at a time, so the caller can write each request as it is built."""
+
+    card_cache = {}
+
+    with ThreadPoolExecutor(max_workers=LIBRIS_MAX_WORKERS) as executor:
+        # Popular records show up in many candidate lists, each ID is only looked up once per run
+        unique_libris_ids = list(dict.fromkeys(
+            libris_id for candidate in match_objects_with_candidates for libris_id in candidate['libris_IDs']
+        ))
+
+        # Fetch records missing from the disk cache in multi-ID batches first
+        LIBRIS_DATA_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        uncached_libris_ids = [libris_id for libris_id in unique_libris_ids if not get_libris_xml_path(libris_id).exists()]
+        uncached_batches = [uncached_libris_ids[i:i + LIBRIS_BATCH_SIZE] for i in range(0, len(uncached_libris_ids), LIBRIS_BATCH_SIZE)]
+        list(executor.map(lambda batch: fetch_libris_batch(batch, verbose), uncached_batches))
+
+        # Every record is then read through the per-ID lookup, which falls back to a single
+        # request for IDs the batches did not return
+        libris_futures = {
+            libris_id: executor.submit(get_prompt_libris_record, libris_id, verbose)
+            for libris_id in unique_libris_ids
+        }
 
-        extracted_data = get_extracted_data(match_object_id, extracted_data_directory, verbose)
+        for candidate in match_objects_with_candidates:
+            match_object_id = candidate['match_object_ID']
+            libris_ids = candidate['libris_IDs']
+            if verbose:
+                print(f"Processing Match Object ID: {match_object_id} with {len(libris_ids)} candidates.")       
 
-        libris_records = []
+            extracted_data = get_extracted_data(match_object_id, extracted_data_directory, verbose, card_cache)
 
-        for libris_id in libris_ids:
-            xml_data = get_libris_record(libris_id, verbose)
-            if xml_data:
-                if verbose:
-                    print(f"✅ Successfully retrieved data for Libris ID {libris_id}")
-            else:
-                if verbose:
-                    print(f"❌ Failed to retrieve data for Libris ID {libris_id}")
+            libris_records = []
 
-            libris_records.append(xml_data)
+            for libris_id in libris_ids:
+                xml_data = libris_futures[libris_id].result()
+                if xml_data:
+                    if verbose:
+                        print(f"✅ Successfully retrieved data for Libris ID {libris_id}")
+                else:
+                    if verbose:
+                        print(f"❌ Failed to retrieve data for Libris ID {libris_id}")
 
-        prompt_contents.append(
-            {
+                libris_records.append(xml_data)
+
+            yield {
                 "match_object_ID": match_object_id,
                 "extracted_data": extracted_data,
                 "libris_records": libris_records
             }
-        )
-
-    return prompt_contents
 
 
 def get_candidates_for_match_object(matches_df, number_of_candidates = 3):
@@ -181,30 +423,35 @@ def get_candidates_for_match_object(matches_df, number_of_candidates = 3):
         .head(number_of_candidates)
     )
     
+    # Drop missing IDs before grouping so the IDs are collected without a per-group Python function,
+    # match objects without any candidate IDs drop out of the result on their own
     match_objects_with_candidates = (
-        top_n_df.groupby('match_object_ID')['matched_ID']
-        .apply(lambda x: [id for id in x if pd.notna(id)])
+        top_n_df.dropna(subset=['matched_ID'])
+        .groupby('match_object_ID')['matched_ID']
+        .agg(list)
         .reset_index(name='libris_IDs')
+        .to_dict(orient='records')
     )
-    
-    match_objects_with_candidates = match_objects_with_candidates[
-        match_objects_with_candidates['libris_IDs'].apply(len) > 0
-    ].to_dict(orient='records')
 
     return match_objects_with_candidates
 
 
 def load_matches(matches_file_path, verbose):
 
+    # Parsing the xlsx is slow, keep a pickled copy next to it that is reused until the xlsx changes
+    matches_file_path = Path(matches_file_path)
+    cache_file_path = matches_file_path.with_suffix('.pkl')
+
     try:
-        matches_df = pd.read_excel(matches_file_path)
+        matches_df = kortkat.cached_pickle_load(matches_file_path, cache_file_path, lambda path: pd.read_excel(path, engine=EXCEL_ENGINE, usecols=MATCHES_COLUMNS), pd.__version__)
         if verbose:
             print(f"✅ Successfully loaded matches file: {matches_file_path}")
-        return matches_df
     except Exception as e:
         print(f"❌ Failed to load matches file: {e}")
         return None
 
+    return matches_df
+
 
 if __name__ == "__main__":
 
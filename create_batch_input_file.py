@@ -2,11 +2,18 @@ from pathlib import Path
 import argparse
 import json
 import base64
+import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
 import importlib.util
+import orjson
 from pydantic import BaseModel
 from typing import Type
 
+# Images handed to the process pool per round, bounds how many encoded requests wait in memory for the writer
+IMAGES_PER_BLOCK = 512
+
 def load_pydantic_class_from_file(instance_path: str, module_file_name: str, class_name: str) -> Type[BaseModel]:
     
     file_path = Path(instance_path) / module_file_name    
@@ -32,15 +39,47 @@ def load_pydantic_class_from_file(instance_path: str, module_file_name: str, cla
         
     return pydantic_class
 
-def process_image(image_path, generation_config, schema):
+def build_request_envelope(generation_config, schema_json):
+    # Everything except the image and key is the same for every request in a run,
+    # so it is built once here and shared by reference in all requests.
+    request_generation_config = {
+        "temperature": generation_config["temperature"],
+        "topP": generation_config["top_p"],
+        "topK": generation_config["top_k"],
+        "stopSequences": generation_config["stopSequences"],
+        "maxOutputTokens": generation_config["max_output_tokens"],
+        "responseMimeType": generation_config["response_mime_type"],
+        "mediaResolution": generation_config["media_resolution"],
+        "responseJsonSchema": schema_json
+    }
+
+    model_name = generation_config["model"]
+
+    if "gemini-3" in model_name:
+        request_generation_config["thinkingConfig"] = {
+           "thinkingLevel": generation_config["thinking_level"]
+        }
+    else:
+        request_generation_config["thinkingConfig"] = {
+           "thinkingBudget": generation_config["thinking_budget"]
+        }
+
+    return {
+        "systemInstruction": {
+            "parts": [{"text": generation_config["system_instruction"]}]
+        },
+        "generationConfig": request_generation_config
+    }
+
+def process_image(image_path, prompt_text, request_envelope):
 
     try:
         with open(image_path, "rb") as image_file:
             image_bytes = image_file.read()
-            base64_bytes = base64.b64encode(image_bytes)
-            base64_string = base64_bytes.decode('utf-8')
+            base64_string = base64.b64encode(image_bytes).decode('ascii')
     except FileNotFoundError:
         print(f"Error: The file '{image_path}' was not found.")
+        return None
     
     request = {
         "key": image_path.stem,
@@ -49,38 +88,23 @@ def process_image(image_path, generation_config, schema):
                     "role": "user",
                     "parts": [
                         {"inlineData": {"mimeType": "image/jpeg", "data": base64_string}},
-                        {"text": generation_config["prompt_text_part"]}
+                        {"text": prompt_text}
                 ]
             }],
-            "systemInstruction": {
-                "parts": [{"text": generation_config["system_instruction"]}]
-            },
-            "generationConfig": {
-                "temperature": generation_config["temperature"],
-                "topP": generation_config["top_p"],
-                "topK": generation_config["top_k"],
-                "stopSequences": generation_config["stopSequences"],
-                "maxOutputTokens": generation_config["max_output_tokens"],
-                "responseMimeType": generation_config["response_mime_type"],
-                "mediaResolution": generation_config["media_resolution"],
-                "responseJsonSchema": schema.model_json_schema()
-            }
+            **request_envelope
         }
     }
 
-    model_name = generation_config["model"]
-
-    if "gemini-3" in model_name:
-        request["request"]["generationConfig"]["thinkingConfig"] = {
-           "thinkingLevel": generation_config["thinking_level"]
-        }
-    else:
-        request["request"]["generationConfig"]["thinkingConfig"] = {
-           "thinkingBudget": generation_config["thinking_budget"]
-        }
-
     return request
 
+def build_request_line(image_path, prompt_text, request_envelope):
+    # Runs in a worker process, so both encoding and serialization of the request happen off the writer.
+    # orjson emits UTF-8 bytes directly, which are written as-is by the parent.
+    result = process_image(image_path, prompt_text, request_envelope)
+    if result:
+        return orjson.dumps(result) + b"\n"
+    return None
+
 def process_directory(input_directory, output_directory, pipeline_directory, generation_config, start_index, end_index, verbose):
     total_images = 0
 
@@ -111,43 +135,53 @@ def process_directory(input_directory, output_directory, pipeline_directory, gen
         # Handle the error (e.g., stop the pipeline)
 
 
+    # Generate the JSON schema once per run. The dynamically loaded schema class cannot be
+    # pickled for the worker processes, so they get the schema dict instead.
+    schema_json = StructuredOutputSchema.model_json_schema()
+
     # Save system instruction to file for future reference
     report_filename = output_directory / "batch_input_file_creation_report.json"
     report_object = {
         "time": f"{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}",
         "generation_config": generation_config,
-        "json_schema": StructuredOutputSchema.model_json_schema()
+        "json_schema": schema_json
     }
     
     with open(report_filename, 'w') as fp:
         json.dump(report_object, fp, indent=4)
 
-    # Loop over all files in the input directory
-    image_files = [f for f in sorted(input_directory.glob('*.jpg'))]
+    # List image names with a single directory scan, paths are only built for the requested slice
+    with os.scandir(input_directory) as entries:
+        image_names = [entry.name for entry in entries if entry.name.endswith('.jpg')]
+    image_names.sort()
 
     if start_index != 0:
         start_index -= 1
 
     if end_index == -1:
-        end_index = len(image_files)
+        end_index = len(image_names)
+
+    selected_image_files = [input_directory / name for name in image_names[start_index:end_index]]
 
     jsonl_filename = output_directory / "batch_input_file.jsonl"
 
-    # delete existing jsonl file if exists
-    if jsonl_filename.exists():
-        jsonl_filename.unlink()
-
-    for i in range(start_index, end_index):        
-        result = process_image(image_files[i], generation_config, StructuredOutputSchema)
-        if result:            
-            with open(jsonl_filename, 'a') as fp:
-                fp.write(json.dumps(result) + "\n")
-            total_images += 1            
-            if verbose:
-                print(f"Added image {image_files[i]} successfully.")
-        else:
-            if verbose:
-                print(f"Failed to add image {image_files[i]}")
+    request_envelope = build_request_envelope(generation_config, schema_json)
+    worker = partial(build_request_line, prompt_text=generation_config["prompt_text_part"], request_envelope=request_envelope)
+
+    # Write mode truncates any existing jsonl file, keep one handle open for the whole batch.
+    # Images are encoded in parallel while this process stays the only writer.
+    with open(jsonl_filename, 'wb', buffering=1 << 20) as fp, ProcessPoolExecutor() as executor:
+        for block_start in range(0, len(selected_image_files), IMAGES_PER_BLOCK):
+            block = selected_image_files[block_start:block_start + IMAGES_PER_BLOCK]
+            for image_file, line in zip(block, executor.map(worker, block, chunksize=16)):
+                if line:            
+                    fp.write(line)
+                    total_images += 1            
+                    if verbose:
+                        print(f"Added image {image_file} successfully.")
+                else:
+                    if verbose:
+                        print(f"Failed to add image {image_file}")
 
     # Check if any images were processed, if not, halt this subprocess
     if total_images == 0:
@@ -158,7 +192,7 @@ def process_directory(input_directory, output_directory, pipeline_directory, gen
 
 
 
-if __name__ == "__main__":
+def main(argv=None):
     
     parser = argparse.ArgumentParser(description="Process images in a directory.")
     parser.add_argument("input_directory", type=Path, help="Path to the image directory")
@@ -168,7 +202,7 @@ if __name__ == "__main__":
     parser.add_argument("--end_index", type=int, default=-1, help="Ending index of images to process (-1 for all)")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     config_file_path = args.pipeline_directory / "config.json"
 
@@ -194,4 +228,8 @@ if __name__ == "__main__":
     
     generation_config = default_generation_config | config_data.get("generation_config", {})
 
-    process_directory(args.input_directory, args.output_directory, args.pipeline_directory, generation_config, args.start_index, args.end_index, args.verbose)
\ No newline at end of file
+    process_directory(args.input_directory, args.output_directory, args.pipeline_directory, generation_config, args.start_index, args.end_index, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
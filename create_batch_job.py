@@ -1,15 +1,95 @@
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from pathlib import Path
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import base64
+import hashlib
+import io
 import json
 import os
+import time
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 
+# Resumable upload chunks have to be sent in order, so a failed upload is retried as a whole
+UPLOAD_MAX_RETRIES = 3
+UPLOAD_INITIAL_BACKOFF_SECONDS = 10
+UPLOAD_MAX_BACKOFF_SECONDS = 120
+
+
+class ReadAheadFile(io.RawIOBase):
+    """Read-only seekable file that reads the next chunk in a background thread.
+
+    The SDK sends the upload in sequential chunks, so while one chunk is on the
+    network the next one is already being read from disk. The bytes handed out are
+    hashed on the way, so the upload can be checked without reading the file again.
+    """
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDONLY)
+        self._size = os.fstat(self._fd).st_size
+        self._position = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetch = None
+        self._sha256 = hashlib.sha256()
+        self._hashed_size = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._position = offset
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._position
+
+        # pread takes an explicit offset, so the prefetch thread never moves a shared file position
+        if self._prefetch and self._prefetch[:2] == (self._position, size):
+            data = self._prefetch[2].result()
+        else:
+            data = os.pread(self._fd, size, self._position)
+
+        # Only a contiguous read from the start gives a hash of the whole file
+        if self._position == self._hashed_size:
+            self._sha256.update(data)
+            self._hashed_size += len(data)
+
+        self._position += len(data)
+        self._prefetch = None
+        if data and self._position < self._size:
+            self._prefetch = (self._position, size, self._executor.submit(os.pread, self._fd, size, self._position))
+
+        return data
+
+    def sha256_digest(self):
+        # None until every byte of the file has been read in order
+        if self._hashed_size != self._size:
+            return None
+        return self._sha256.digest()
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=True)
+            os.close(self._fd)
+        super().close()
+
 def create_batch_job(batch_input_file, output_directory, client, job_name, generation_config):
 
     batch_job = client.batches.create(
@@ -28,18 +108,48 @@ def create_batch_job(batch_input_file, output_directory, client, job_name, gener
         
         print(f"Created batch job from file: {batch_job.name}")
 
+def verify_upload_hash(uploaded_file, local_sha256):
+    # The hash reported for the stored file is compared against the bytes that were sent.
+    # The API documents it as base64, accept the hex forms too to be safe.
+    if local_sha256 is None or not uploaded_file.sha256_hash:
+        print("Could not verify the uploaded file hash.")
+        return
+
+    hex_digest = local_sha256.hex()
+    accepted_forms = {
+        hex_digest,
+        base64.b64encode(local_sha256).decode('ascii'),
+        base64.b64encode(hex_digest.encode('ascii')).decode('ascii')
+    }
+    if uploaded_file.sha256_hash in accepted_forms:
+        print(f"Verified uploaded file hash: sha256 {hex_digest}")
+    else:
+        print(f"Warning: uploaded file hash {uploaded_file.sha256_hash} does not match local sha256 {hex_digest}")
+
 def upload_input_file(input_file_path, client, job_name, output_directory):
 
     display_name = job_name + "_input_file"
 
     print(f"Uploading input file: {input_file_path}...")
     try:
-        batch_input_file = client.files.upload(
-            file=input_file_path,
-            # config=types.UploadFileConfig(display_name=display_name, mime_type="application/jsonl")
-            config=types.UploadFileConfig(display_name=display_name, mime_type="text/plain")
-        )
+        for attempt in range(UPLOAD_MAX_RETRIES + 1):
+            try:
+                with ReadAheadFile(input_file_path) as input_file:
+                    batch_input_file = client.files.upload(
+                        file=input_file,
+                        # config=types.UploadFileConfig(display_name=display_name, mime_type="application/jsonl")
+                        config=types.UploadFileConfig(display_name=display_name, mime_type="text/plain")
+                    )
+                    local_sha256 = input_file.sha256_digest()
+                break
+            except (errors.ServerError, httpx.TransportError) as e:
+                if attempt == UPLOAD_MAX_RETRIES:
+                    raise
+                delay = min(UPLOAD_MAX_BACKOFF_SECONDS, UPLOAD_INITIAL_BACKOFF_SECONDS * 2 ** attempt)
+                print(f"Upload failed ({e}), retrying in {delay} seconds...")
+                time.sleep(delay)
         print(f"Uploaded file: {batch_input_file.name}")
+        verify_upload_hash(batch_input_file, local_sha256)
         
         batch_input_file_info_filename = output_directory / "batch_input_file_info.json"
         batch_input_file_info = batch_input_file.model_dump_json(indent=4)
@@ -51,14 +161,14 @@ def upload_input_file(input_file_path, client, job_name, output_directory):
         print(f"Error uploading file: {e}")
         raise e   
 
-if __name__ == "__main__":
+def main(argv=None):
     
     parser = argparse.ArgumentParser(description="Create batch job from input directory.")
     parser.add_argument("batch_input_file", type=Path, help="Path to the batch input file")
     parser.add_argument("output_directory", type=Path, help="Path to where to put the json output")
     parser.add_argument("pipeline_directory", type=Path, help="Path to the pipeline directory")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     config_file_path = args.pipeline_directory / "config.json"
 
@@ -80,4 +190,8 @@ if __name__ == "__main__":
 
     uploaded_batch_input_file = upload_input_file(args.batch_input_file, client, job_name, args.output_directory)
 
-    create_batch_job(uploaded_batch_input_file, args.output_directory, client, job_name, generation_config)
\ No newline at end of file
+    create_batch_job(uploaded_batch_input_file, args.output_directory, client, job_name, generation_config)
+
+
+if __name__ == "__main__":
+    main()
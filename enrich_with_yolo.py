@@ -1,67 +1,146 @@
 import argparse
-import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import kortkat
+import os
 from pathlib import Path
-import pandas as pd
-import shutil
+import re
+import orjson
 
-def load_config(config_file):
-    with open(config_file, 'r') as f:
-        config = json.load(f)
-    return config
+# Card files are independent of each other, so they are rewritten by a pool of threads.
+# Parsing holds the GIL, the gain comes from overlapping the file reads and writes.
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
-def update_json_file(json_path, schema_version, verbose):
+# Number of worker messages collected before they are printed in one go
+PRINT_BATCH_SIZE = 256
+
+# Patch the marker straight into the file bytes when that is unambiguous, instead of
+# parsing and re-serializing the whole card for a single key
+FAST_PATCH = True
+
+# The marker written for a schema version, with every byte string the patch needs encoded up front
+ReferenceMarker = namedtuple("ReferenceMarker", ["key", "value", "key_bytes", "value_bytes", "appended_member", "only_member"])
+
+def reference_marker(key, value):
+    key_bytes = orjson.dumps(key)
+    value_bytes = orjson.dumps(value)
+    member = key_bytes + b': ' + value_bytes
+    return ReferenceMarker(key, value, key_bytes, value_bytes, b', ' + member, b' ' + member)
+
+REFERENCE_MARKERS = {
+    1: reference_marker("publication_type", "cross-reference"),
+    2: reference_marker("is_reference_card", True),
+}
+
+JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+def patch_json_bytes(raw, marker):
+    # Returns the patched bytes, or None when the file has to go through the parser
+    stripped = raw.strip()
+    if not stripped.startswith(b'{') or not stripped.endswith(b'}'):
+        return None
+
+    key = marker.key_bytes
+    occurrences = raw.count(key)
+    if occurrences == 0:
+        # Add the key as the last member of the top-level object
+        closing_brace = raw.rindex(b'}')
+        head = raw[:closing_brace].rstrip()
+        member = marker.only_member if head.endswith(b'{') else marker.appended_member
+        return head + member + raw[len(head):]
+
+    if occurrences != 1:
+        return None
+
+    # A single occurrence used as a key with a scalar value, which can be swapped out in place.
+    # Quotes inside JSON strings are escaped, so an unescaped key followed by a colon is a real key.
+    match = re.search(rb'(?<!\\)' + re.escape(key) + rb'\s*:\s*(true|false|null|"[^"\\]*")', raw)
+    if match is None:
+        return None
+
+    # Only patch the key of the top-level object, not one in a nested object
+    prefix = JSON_STRING.sub(b'""', raw[:match.start()])
+    depth = prefix.count(b'{') + prefix.count(b'[') - prefix.count(b'}') - prefix.count(b']')
+    if depth != 1:
+        return None
+
+    return raw[:match.start(1)] + marker.value_bytes + raw[match.end(1):]
+
+
+def update_json_file(json_path, marker, verbose):
+    # Runs in a worker thread, the message to print is returned to the main thread
+    key, value = marker.key, marker.value
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_path, 'rb') as f:
+            raw = f.read()
+
+        if FAST_PATCH:
+            patched = patch_json_bytes(raw, marker)
+            if patched == raw:
+                return f"ℹ️  Already marked: {os.path.basename(json_path)}" if verbose else None
+            if patched is not None:
+                kortkat.write_bytes_atomic(json_path, patched)
+                return f"✅ Updated: {os.path.basename(json_path)}" if verbose else None
+
+        data = orjson.loads(raw)
 
         if isinstance(data, list):
             if len(data) != 1:
-                print(f"⚠️  Skipping {json_path.name}: expected single-object list.")
-                return
+                return f"⚠️  Skipping {os.path.basename(json_path)}: expected single-object list."
             obj = data[0]
         elif isinstance(data, dict):
             obj = data
         else:
-            print(f"⚠️  Skipping {json_path.name}: unexpected JSON structure.")
-            return
-        
-        if schema_version == 1:
-            obj["publication_type"] = "cross-reference"
-        elif schema_version == 2:
-            obj["is_reference_card"] = True
-        else:
-            print(f"⚠️  Skipping {json_path.name}: unsupported schema version {schema_version}.")
-            return
+            return f"⚠️  Skipping {os.path.basename(json_path)}: unexpected JSON structure."
 
-        # Write back, preserving the original structure
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        if verbose:
-            print(f"✅ Updated: {json_path.name}")
+        # Reruns find most cards already marked, leave those files untouched
+        if key in obj and type(obj[key]) is type(value) and obj[key] == value:
+            return f"ℹ️  Already marked: {os.path.basename(json_path)}" if verbose else None
+
+        obj[key] = value
+
+        # Write back, preserving the original structure. orjson's 2-space indent and
+        # UTF-8 output match json.dump(indent=2, ensure_ascii=False) byte for byte.
+        kortkat.write_bytes_atomic(json_path, orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return f"✅ Updated: {os.path.basename(json_path)}" if verbose else None
 
     except Exception as e:
-        if verbose:
-            print(f"❌ Error processing {json_path.name}: {e}")
+        return f"❌ Error processing {os.path.basename(json_path)}: {e}" if verbose else None
+
 
+def find_reference_card_files(processing_directory, yolo_data):
+    # One directory scan instead of a stat per referenced card. The result follows the
+    # order of the reference list, with each card once, as plain path strings.
+    with os.scandir(processing_directory) as entries:
+        existing_files = {entry.name[:-5]: entry.path for entry in entries if entry.name.endswith('.json')}
 
-def parse_arguments():
+    return [existing_files[card] for card in dict.fromkeys(map(str, yolo_data)) if card in existing_files]
+
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Update publication_type in JSON files for referenced cards.")
     parser.add_argument("pipeline_directory", type=Path, help="Directory containing the pipeline")
     parser.add_argument("config_file", type=Path, help="Path to pipeline config file (config.json)")
     parser.add_argument("processing_directory", type=Path, help="Directory containing JSON files to enrich")
     parser.add_argument("--schema-version", type=int, default=2, help="Schema version to use (default: 1)")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parse_arguments()
+def main(argv=None):
+    args = parse_arguments(argv)
 
     pipeline_directory = args.pipeline_directory
     config_file = args.config_file
     processing_directory = args.processing_directory
 
-    config_data = load_config(config_file)
+    # The marker only depends on the schema version, pick it once for the whole run
+    marker = REFERENCE_MARKERS.get(args.schema_version)
+    if marker is None:
+        print(f"❌ Unsupported schema version {args.schema_version}.")
+        return
+
+    config_data = kortkat.load_config(config_file)
 
     processing_arguments = config_data.get("post_process_arguments", {}).get("enrich_with_yolo", {})
     yolo_data_path = Path(pipeline_directory / processing_arguments.get("yolo_data_path")).resolve()
@@ -69,17 +148,29 @@ def main():
     
     # load json array
     try:
-        with open(yolo_data_path, 'r', encoding='utf-8') as f:
-            yolo_data = json.load(f)
+        # The reference lists are large, keep a parsed copy in the pipeline's cache directory
+        yolo_data = kortkat.cached_json_load(yolo_data_path, pipeline_directory / ".cache")
     except Exception as e:
         print(f"❌ Failed to read yolo json file: {e}")
         return
    
         
-    for card in yolo_data:
-        json_file = processing_directory / f"{card}.json"
-        if json_file.exists():
-            update_json_file(json_file, args.schema_version, args.verbose)
+    json_files = find_reference_card_files(processing_directory, yolo_data)
+
+    # Messages are printed from this thread in batches, so workers never wait on stdout
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        messages = []
+        for message in executor.map(lambda json_file: update_json_file(json_file, marker, args.verbose), json_files):
+            if message:
+                messages.append(message)
+            if len(messages) >= PRINT_BATCH_SIZE:
+                print("\n".join(messages))
+                messages.clear()
+        if messages:
+            print("\n".join(messages))
+
+    # All renames are done, make them durable together
+    kortkat.fsync_directory(processing_directory)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
+import importlib.util
 import json
+import re
 import pandas as pd
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,11 +11,32 @@ from sklearn.metrics import classification_report
 from matplotlib.backends.backend_pdf import PdfPages
 import array as arr
 from datetime import datetime
+import kortkat
 
 # TODO Document the required format of the match results and ground truth files
 
+# The Rust based calamine reader parses xlsx files much faster than openpyxl, use it when it is installed
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
 
-def load_data(match_results_path, ground_truth_path):
+# Low-cardinality text columns of the merged matches that the evaluation compares over and over
+CATEGORICAL_COLUMNS = ["box", "card_type", "match_stat", "gt_card_type", "gt_truth_type"]
+
+# Columns the evaluation needs, read when the other columns should be left out of the report
+MATCHES_COLUMNS = ["box", "card", "card_ID", "card_type", "match_object_ID", "matched_ID", "similarity", "match_stat"]
+GROUND_TRUTH_COLUMNS = ["card_ID", "gt_entry_ID", "gt_card_type", "gt_truth_type", "libris_ID"]
+
+# An ID in a ground truth ID string: the text between commas or semicolons, without surrounding whitespace
+GT_ID_PATTERN = re.compile(r"[^\s,;](?:[^,;]*[^\s,;])?")
+
+
+def read_excel_cached(excel_path, usecols=None):
+    # Parsing the xlsx is slow, keep a pickled copy next to it that is reused until the xlsx changes.
+    # The suffix differs from the matches cache of compare-candidates.py, which only holds some columns.
+    cache_path = excel_path.with_suffix(".report.pkl" if usecols is None else ".report-columns.pkl")
+    return kortkat.cached_pickle_load(excel_path, cache_path, lambda path: pd.read_excel(path, engine=EXCEL_ENGINE, usecols=usecols, dtype={"box": object, "card": object}), pd.__version__)
+
+
+def load_data(match_results_path, ground_truth_path, required_columns_only=False):
 
     matchresults_df = None
     gt_df = None
@@ -22,7 +46,7 @@ def load_data(match_results_path, ground_truth_path):
         raise ValueError(f"Ground truth file must be an Excel file")
     else:
         try:
-            matchresults_df = pd.read_excel(match_results_path, dtype={"box": object, "card": object})
+            matchresults_df = read_excel_cached(match_results_path, MATCHES_COLUMNS if required_columns_only else None)
             print(f"Loaded match results from {match_results_path}")
         except Exception as e:
             print(f"  Error loading {match_results_path}: {e}")        
@@ -32,7 +56,7 @@ def load_data(match_results_path, ground_truth_path):
         raise ValueError(f"Ground truth file must be an Excel file")
     else:
         try:
-            gt_df = pd.read_excel(ground_truth_path, dtype={"box": object, "card": object})
+            gt_df = read_excel_cached(ground_truth_path, GROUND_TRUTH_COLUMNS if required_columns_only else None)
             print(f"Loaded ground truth data from {ground_truth_path}")
         except Exception as e:
             print(f"  Error loading {ground_truth_path}: {e}")
@@ -40,25 +64,26 @@ def load_data(match_results_path, ground_truth_path):
 
     if matchresults_df is not None and not matchresults_df.empty and gt_df is not None and not gt_df.empty:
 
-        initial_count_of_match_objects = matchresults_df['match_object_ID'].nunique()
-        initial_count_of_cards_from_match = matchresults_df['card_ID'].nunique()
+        # Match objects and ground truth entries each belong to a single card, so counts of the remaining
+        # and removed entries are sums of the per-card counts below instead of new passes over the columns
+        initial_count_of_match_objects, initial_count_of_cards_from_match = matchresults_df[['match_object_ID', 'card_ID']].nunique()
         print(f"- Initial number of match objects: {initial_count_of_match_objects} (from {initial_count_of_cards_from_match} cards)")
         
-        initial_count_of_gt_entries = gt_df['gt_entry_ID'].nunique()
-        initial_count_of_cards_from_gt = gt_df['card_ID'].nunique() 
+        initial_count_of_gt_entries, initial_count_of_cards_from_gt = gt_df[['gt_entry_ID', 'card_ID']].nunique()
         print(f"- Initial number of ground truth entries: {initial_count_of_gt_entries} (from {initial_count_of_cards_from_gt} cards)")
 
-        # Count the number of unique "Hänvisning" card types in match results
-        number_of_reference_match_objects = matchresults_df[matchresults_df["card_type"] == "Hänvisning"]["match_object_ID"].nunique()
-        
         # Remove "Hänvisning" card type from match results
         matchresults_without_references_df = matchresults_df[matchresults_df["card_type"] != "Hänvisning"]
-        print(f"- Ignoring {number_of_reference_match_objects} match objects where card type is \"Hänvisning\"")        
 
         # Count unique match_object_ids per card_id        
         match_objects_per_card_from_match = matchresults_without_references_df.groupby('card_ID')['match_object_ID'].nunique().reset_index()
         match_objects_per_card_from_match.rename(columns={'match_object_ID': 'unique_match_objects'}, inplace=True)
 
+        # Count the number of unique "Hänvisning" card types in match results
+        count_of_match_objects_without_references = match_objects_per_card_from_match['unique_match_objects'].sum()
+        number_of_reference_match_objects = initial_count_of_match_objects - count_of_match_objects_without_references
+        print(f"- Ignoring {number_of_reference_match_objects} match objects where card type is \"Hänvisning\"")        
+
         match_objects_per_card_from_gt = gt_df.groupby('card_ID')['gt_entry_ID'].nunique().reset_index()
         match_objects_per_card_from_gt.rename(columns={'gt_entry_ID': 'unique_gt_entries'}, inplace=True)
 
@@ -66,13 +91,14 @@ def load_data(match_results_path, ground_truth_path):
         matching_cards = pd.merge(match_objects_per_card_from_match, match_objects_per_card_from_gt, on='card_ID', how='inner')
         matching_cards = matching_cards[matching_cards['unique_match_objects'] == matching_cards['unique_gt_entries']]        
 
-        # Filter the original dataframes to only include the matching card_ids
-        matchresults_without_references_filtered_df = matchresults_without_references_df[matchresults_without_references_df['card_ID'].isin(matching_cards['card_ID'])]
-        gt_filtered_df = gt_df[gt_df['card_ID'].isin(matching_cards['card_ID'])]
+        # Filter the original dataframes to only include the matching card_ids, as a semi-join against
+        # the card_ID index. Each card_ID is in the index once, so rows keep their order and are never repeated.
+        matching_card_index = matching_cards.set_index('card_ID')[[]]
+        matchresults_without_references_filtered_df = matchresults_without_references_df.join(matching_card_index, on='card_ID', how='inner')
+        gt_filtered_df = gt_df.join(matching_card_index, on='card_ID', how='inner')
 
-        count_of_match_objects_without_references = matchresults_without_references_df['match_object_ID'].nunique()
-        remaining_count_of_match_objects = matchresults_without_references_filtered_df['match_object_ID'].nunique()
-        remaining_count_of_gt_entries = gt_filtered_df['gt_entry_ID'].nunique()
+        remaining_count_of_match_objects = matching_cards['unique_match_objects'].sum()
+        remaining_count_of_gt_entries = matching_cards['unique_gt_entries'].sum()
 
         removed_count_of_match_objects = count_of_match_objects_without_references - remaining_count_of_match_objects
         removed_count_of_gt_entries = initial_count_of_gt_entries - remaining_count_of_gt_entries
@@ -81,6 +107,10 @@ def load_data(match_results_path, ground_truth_path):
 
         # Merge match results with ground truth data
         merged_df = matchresults_without_references_filtered_df.merge(gt_filtered_df, how="inner", left_on="match_object_ID", right_on="gt_entry_ID", suffixes=(None, "_gt"))        
+
+        # As categoricals those comparisons run on the integer codes instead of the strings
+        for column in CATEGORICAL_COLUMNS:
+            merged_df[column] = merged_df[column].astype("category")
         
     else:        
         print("No match results or ground truth data found.")
@@ -120,80 +150,113 @@ def evaluate_extracted_occurences(matchresults_df, gt_df):
     return counts_df
 
     
-def evaluate_matches(matches_df, output_directory, job_name):
+def evaluate_matches(matches_df, output_directory, job_name, pdf_executor=None):
     
-    # Evaluate if the matched ID is in the libris_ID
-    matches_df['match_result'] = matches_df.apply(evaluate_match, axis=1)    
+    # Evaluate if the matched ID is in the libris_ID, for all rows at once
+    no_match_mask = (matches_df['match_stat'] == "No match").to_numpy()
+    no_edition_mask = (matches_df['match_stat'] == "No edition").to_numpy()
+    truth_no_match_mask = (matches_df['gt_truth_type'] == "no-match").to_numpy()
+
+    gt_id_sets = matches_df['libris_ID'].map(lambda libris_id: set(parse_gt_id_string(libris_id)))
+    contains_mask = np.array([matched_id in gt_ids for matched_id, gt_ids in zip(matches_df['matched_ID'].to_numpy(), gt_id_sets)], dtype=bool)
+
+    matches_df['match_result'] = pd.Categorical(np.select(
+        [no_match_mask & truth_no_match_mask, no_match_mask, no_edition_mask, contains_mask],
+        ["Correct", "Incorrect", "No edition", "Correct"],
+        default="Incorrect"
+    ))
     
-    correct_single_matches = matches_df[(matches_df["match_result"] == "Correct") & (matches_df["match_stat"] == "Single")]
-    incorrect_single_matches = matches_df[(matches_df["match_result"] == "Incorrect") & (matches_df["match_stat"] == "Single")]
+    # Masks used by the subsets below, computed once
+    is_correct = (matches_df["match_result"] == "Correct").to_numpy()
+    is_incorrect = (matches_df["match_result"] == "Incorrect").to_numpy()
+    is_single = (matches_df["match_stat"] == "Single").to_numpy()
+    is_multiple = (matches_df["match_stat"] == "Multiple").to_numpy()
+    is_unqualified_single = (matches_df["match_stat"] == "Unqualified").to_numpy()
+    is_unqualified_multiple = (matches_df["match_stat"] == "Unqualified multiple").to_numpy()
+
+    match_object_ids = matches_df["match_object_ID"].to_numpy()
+
+    def has_correct_candidate(correct_mask):
+        # For each row, if any row of the same match object is in the mask
+        return pd.Series(correct_mask).groupby(match_object_ids).transform("any").to_numpy()
+
+    correct_single_matches = matches_df[is_correct & is_single]
+    incorrect_single_matches = matches_df[is_incorrect & is_single]
     
-    correct_multiple_matches = matches_df[(matches_df["match_result"] == "Correct") & (matches_df["match_stat"] == "Multiple")]
-    incorrect_multiple_matches = matches_df[matches_df["match_stat"] == "Multiple"].groupby("match_object_ID").filter(lambda g: (g["match_result"] != "Correct").all())
+    correct_multiple_matches = matches_df[is_correct & is_multiple]
+    incorrect_multiple_matches = matches_df[is_multiple & ~has_correct_candidate(is_correct & is_multiple)]
     
-    correct_unqualified_single_matches = matches_df[(matches_df["match_result"] == "Correct") & (matches_df["match_stat"] == "Unqualified")]
-    incorrect_unqualified_single_matches = matches_df[(matches_df["match_result"] == "Incorrect") & (matches_df["match_stat"] == "Unqualified")]
+    correct_unqualified_single_matches = matches_df[is_correct & is_unqualified_single]
+    incorrect_unqualified_single_matches = matches_df[is_incorrect & is_unqualified_single]
     
-    correct_unqualified_multiple_matches = matches_df[(matches_df["match_result"] == "Correct") & (matches_df["match_stat"] == "Unqualified multiple")]
-    incorrect_unqualified_multiple_matches = matches_df[matches_df["match_stat"] == "Unqualified multiple"].groupby("match_object_ID").filter(lambda g: (g["match_result"] != "Correct").all())    
+    correct_unqualified_multiple_matches = matches_df[is_correct & is_unqualified_multiple]
+    incorrect_unqualified_multiple_matches = matches_df[is_unqualified_multiple & ~has_correct_candidate(is_correct & is_unqualified_multiple)]    
 
     matches_similarity_scores = {
         "single_matches": {
             "title": "Distribution of match candidates - single matches",
             "cumulative_mode": "series",
-            "correct": correct_single_matches["similarity"].tolist(),
-            "incorrect": incorrect_single_matches["similarity"].tolist()
+            "correct": correct_single_matches["similarity"].to_numpy(),
+            "incorrect": incorrect_single_matches["similarity"].to_numpy()
         },
         "multiple_matches": {
             "title": "Distribution of match candidates - multiple matches",
             "cumulative_mode": "series",
-            "correct": correct_multiple_matches["similarity"].tolist(),
-            "incorrect": incorrect_multiple_matches["similarity"].tolist()
+            "correct": correct_multiple_matches["similarity"].to_numpy(),
+            "incorrect": incorrect_multiple_matches["similarity"].to_numpy()
         },
         "unqualified_single_matches": {
             "title": "Distribution of match candidates - unqualified single matches",
             "cumulative_mode": "series",
-            "correct": correct_unqualified_single_matches["similarity"].tolist(),
-            "incorrect": incorrect_unqualified_single_matches["similarity"].tolist()
+            "correct": correct_unqualified_single_matches["similarity"].to_numpy(),
+            "incorrect": incorrect_unqualified_single_matches["similarity"].to_numpy()
         },
         "unqualified_multiple_matches": {
             "title": "Distribution of match candidates - unqualified multiple matches",
             "cumulative_mode": "series",
-            "correct": correct_unqualified_multiple_matches["similarity"].tolist(),
-            "incorrect": incorrect_unqualified_multiple_matches["similarity"].tolist()
+            "correct": correct_unqualified_multiple_matches["similarity"].to_numpy(),
+            "incorrect": incorrect_unqualified_multiple_matches["similarity"].to_numpy()
         }
     }
 
     # Label each match as correct/incorrect/no edition/top correct
-    results_df = matches_df.groupby("match_object_ID").apply(label_matches).reset_index(drop=True)
+    results_df = label_matches(matches_df)
+
+    # Masks used by the subsets of results below, computed once
+    result_is_correct = (results_df["result"] == "Correct").to_numpy()
+    result_is_secondary_correct = (results_df["result"] == "Secondary correct").to_numpy()
+    result_is_incorrect = (results_df["result"] == "Incorrect").to_numpy()
+    result_is_single = (results_df["match_stat"] == "Single").to_numpy()
+    result_is_multiple = (results_df["match_stat"] == "Multiple").to_numpy()
+    result_is_monograph = (results_df["card_type"] == "Monografi").to_numpy()
 
     # Generate subsets of results for different analyses
-    top_correct_single_match_results = results_df[(results_df["result"] == "Correct") & (results_df["match_stat"] == "Single")]
-    top_correct_multiple_match_results = results_df[(results_df["result"] == "Correct") & (results_df["match_stat"] == "Multiple")]
+    top_correct_single_match_results = results_df[result_is_correct & result_is_single]
+    top_correct_multiple_match_results = results_df[result_is_correct & result_is_multiple]
 
-    correct_multiple_match_results = results_df[(results_df["result"] == "Secondary correct") & (results_df["match_stat"] == "Multiple")]
-    incorrect_multiple_match_results = results_df[(results_df["result"] == "Incorrect") & (results_df["match_stat"] == "Multiple")]
-    top_correct_match_results = results_df[(results_df["result"] == "Correct") & (results_df["match_stat"] == "Multiple") | (results_df["result"] == "Correct") & (results_df["match_stat"] == "Single")]
-    incorrect_single_match_results = results_df[(results_df["result"] == "Incorrect") & (results_df["match_stat"] == "Single")]
+    correct_multiple_match_results = results_df[result_is_secondary_correct & result_is_multiple]
+    incorrect_multiple_match_results = results_df[result_is_incorrect & result_is_multiple]
+    top_correct_match_results = results_df[result_is_correct & (result_is_multiple | result_is_single)]
+    incorrect_single_match_results = results_df[result_is_incorrect & result_is_single]
 
     match_results_similarity_scores = {
         "top_correct_single_matches": {
             "cumulative_mode": "series",
             "title": "Distribution of match results (single) - top correct vs incorrect",
-            "correct": top_correct_single_match_results["matched_similarity"].tolist(),
-            "incorrect": incorrect_single_match_results["matched_similarity"].tolist()
+            "correct": top_correct_single_match_results["matched_similarity"].to_numpy(),
+            "incorrect": incorrect_single_match_results["matched_similarity"].to_numpy()
         },
         "top_correct_multiple_matches": {
             "cumulative_mode": "series",
             "title": "Distribution of match results (multiple) - top correct vs correct + incorrect",
-            "correct": top_correct_multiple_match_results["matched_similarity"].tolist(),
-            "incorrect": incorrect_multiple_match_results["matched_similarity"].tolist() + correct_multiple_match_results["matched_similarity"].tolist()
+            "correct": top_correct_multiple_match_results["matched_similarity"].to_numpy(),
+            "incorrect": np.concatenate([incorrect_multiple_match_results["matched_similarity"].to_numpy(), correct_multiple_match_results["matched_similarity"].to_numpy()])
         },
         "correct_multiple_matches": {
             "title": "Distribution of match results - correct vs incorrect multiple matches",
             "cumulative_mode": "series",
-            "correct": correct_multiple_match_results["matched_similarity"].tolist(),
-            "incorrect": incorrect_multiple_match_results["matched_similarity"].tolist()
+            "correct": correct_multiple_match_results["matched_similarity"].to_numpy(),
+            "incorrect": incorrect_multiple_match_results["matched_similarity"].to_numpy()
         }
     }
 
@@ -201,128 +264,119 @@ def evaluate_matches(matches_df, output_directory, job_name):
         "all": {
             "title": "Distribution of match results (all) - top correct vs correct + incorrect",
             "cumulative_mode": "total",
-            "correct": top_correct_match_results["matched_similarity"].tolist(),
-            "incorrect": incorrect_multiple_match_results["matched_similarity"].tolist() + incorrect_single_match_results["matched_similarity"].tolist() + correct_multiple_match_results["matched_similarity"].tolist()
+            "correct": top_correct_match_results["matched_similarity"].to_numpy(),
+            "incorrect": np.concatenate([incorrect_multiple_match_results["matched_similarity"].to_numpy(), incorrect_single_match_results["matched_similarity"].to_numpy(), correct_multiple_match_results["matched_similarity"].to_numpy()])
         }
     }
 
     # Match results for mongraphs
-    correct_single_match_results_monographs = results_df[(results_df["result"] == "Correct") & (results_df["match_stat"] == "Single") & (results_df["card_type"] == "Monografi")]
-    incorrect_single_match_results_monographs = results_df[(results_df["result"] == "Incorrect") & (results_df["match_stat"] == "Single") & (results_df["card_type"] == "Monografi")]
+    correct_single_match_results_monographs = results_df[result_is_correct & result_is_single & result_is_monograph]
+    incorrect_single_match_results_monographs = results_df[result_is_incorrect & result_is_single & result_is_monograph]
     monographs_match_results_similarity_scores = {
         "single": {
             "cumulative_mode": "total",
             "title": "Distribution of match results (single, monographs) - correct vs incorrect",
-            "correct": correct_single_match_results_monographs["matched_similarity"].tolist(),
-            "incorrect": incorrect_single_match_results_monographs["matched_similarity"].tolist()
+            "correct": correct_single_match_results_monographs["matched_similarity"].to_numpy(),
+            "incorrect": incorrect_single_match_results_monographs["matched_similarity"].to_numpy()
         }
     }
 
-    generate_pdf_report([matches_similarity_scores, match_results_similarity_scores, total_match_results_similarity_scores, monographs_match_results_similarity_scores], output_directory, job_name)
-
-    return matches_df, results_df    
-
-
-def label_matches(group):
+    similarity_scores_list = [matches_similarity_scores, match_results_similarity_scores, total_match_results_similarity_scores, monographs_match_results_similarity_scores]
 
-    matched_similarity = None
-    matched_ID = None
-    correct_count =None
-
-    if (group['match_stat'] == 'No match').any():
-        row = group.iloc[0]
-        if row['match_result'] == 'Correct':
-            result = "Correct"
-        else:
-            result = "Incorrect"            
-    elif (group['match_stat'] == 'No edition').any():
-        result = "No edition"
-    else:        
-        top_candidate = group.loc[group['similarity'].idxmax()].copy()
-        correct_count = (group['match_result'] == 'Correct').sum()        
-        if top_candidate["match_result"] == "Correct":
-            result = "Correct"
-            matched_similarity = top_candidate["similarity"]
-            matched_ID = top_candidate["matched_ID"]
-        elif correct_count > 0:
-            group_copy = group.copy()
-            candidates_to_keep = group_copy['match_result'] == "Correct"
-            group_copy = group_copy[candidates_to_keep]
-            top_candidate = group_copy.loc[group_copy['similarity'].idxmax()].copy()
-            result = "Secondary correct"
-            matched_similarity = top_candidate["similarity"]
-            matched_ID = top_candidate["matched_ID"]
-        else:
-            matched_similarity = top_candidate["similarity"]
-            matched_ID = top_candidate["matched_ID"]
-            result = "Incorrect"
-
-    results = pd.Series({
-        "box": group['box'].iloc[0],
-        "card": group['card'].iloc[0],
-        "card_ID": group['card_ID'].iloc[0],
-        "match_object_ID": group['match_object_ID'].iloc[0],        
-        "kortkat_URL": f"https://kortkat.ub.gu.se/card/{group["box"].iloc[0]}/{group["card"].iloc[0]}",        
-        "gt_card_type": group['gt_card_type'].iloc[0],
-        "gt_truth_type": group['gt_truth_type'].iloc[0],
-        "gt_libris_ID": group['libris_ID'].iloc[0],
-        "card_type": group['card_type'].iloc[0],
-        "match_stat": group['match_stat'].iloc[0],        
+    # With an executor the PDF is drawn in the background while the caller goes on, and the future is returned
+    pdf_report = None
+    if pdf_executor is not None:
+        pdf_report = pdf_executor.submit(generate_pdf_report, similarity_scores_list, output_directory, job_name)
+    else:
+        generate_pdf_report(similarity_scores_list, output_directory, job_name)
+
+    return matches_df, results_df, pdf_report
+
+
+def label_matches(matches_df):
+    # One result row per match object, in match_object_ID order
+
+    # Fields that are the same for all candidates are taken from the first row of each match object
+    first_rows = matches_df.drop_duplicates("match_object_ID").set_index("match_object_ID", drop=False).sort_index()
+    match_object_ids = first_rows.index
+
+    # Sort all candidates by similarity once, the top candidate of each match object is then its first row.
+    # The stable sort keeps candidates with equal similarity in their original order, like idxmax.
+    sorted_matches = matches_df.sort_values("similarity", ascending=False, kind="stable")
+    correct_mask = sorted_matches["match_result"] == "Correct"
+
+    group_flags = sorted_matches.assign(
+        has_no_match=sorted_matches["match_stat"] == "No match",
+        has_no_edition=sorted_matches["match_stat"] == "No edition",
+        correct_count=correct_mask
+    ).groupby("match_object_ID").agg({"has_no_match": "any", "has_no_edition": "any", "correct_count": "sum"}).reindex(match_object_ids)
+
+    top_candidates = sorted_matches.drop_duplicates("match_object_ID").set_index("match_object_ID").reindex(match_object_ids)
+    top_correct_candidates = sorted_matches[correct_mask].drop_duplicates("match_object_ID").set_index("match_object_ID").reindex(match_object_ids)
+
+    has_no_match = group_flags["has_no_match"].to_numpy()
+    has_no_edition = group_flags["has_no_edition"].to_numpy()
+    has_candidates = ~has_no_match & ~has_no_edition
+    top_is_correct = top_candidates["match_result"].to_numpy() == "Correct"
+    has_correct = group_flags["correct_count"].to_numpy() > 0
+    first_is_correct = first_rows["match_result"].to_numpy() == "Correct"
+
+    result = np.select(
+        [has_no_match & first_is_correct, has_no_match, has_no_edition, top_is_correct, has_correct],
+        ["Correct", "Incorrect", "No edition", "Correct", "Secondary correct"],
+        default="Incorrect"
+    ).astype(object)
+
+    # The matched candidate is the top candidate, or the top correct one for secondary correct matches
+    secondary_mask = has_candidates & ~top_is_correct & has_correct
+    matched_ID = np.where(secondary_mask, top_correct_candidates["matched_ID"].to_numpy(), top_candidates["matched_ID"].to_numpy())
+    matched_ID[~has_candidates] = None
+    matched_similarity = np.where(secondary_mask, top_correct_candidates["similarity"].to_numpy(), top_candidates["similarity"].to_numpy())
+    matched_similarity = np.where(has_candidates, matched_similarity, np.nan)
+
+    # All candidates of each match object, best first
+    matched_IDs = sorted_matches["matched_ID"].astype(str).where(sorted_matches["matched_ID"].notna(), '')
+    similarity_scores = sorted_matches["similarity"].map("{:.4f}".format).where(sorted_matches["similarity"].notna(), '')
+    candidate_strings = pd.DataFrame({"matched_IDs": matched_IDs, "similarity_scores": similarity_scores}).groupby(sorted_matches["match_object_ID"]).agg(", ".join).reindex(match_object_ids)
+
+    results = pd.DataFrame({
+        "box": first_rows['box'].to_numpy(),
+        "card": first_rows['card'].to_numpy(),
+        "card_ID": first_rows['card_ID'].to_numpy(),
+        "match_object_ID": first_rows['match_object_ID'].to_numpy(),
+        "kortkat_URL": ("https://kortkat.ub.gu.se/card/" + first_rows["box"].astype(object).map(str) + "/" + first_rows["card"].astype(object).map(str)).to_numpy(),
+        "gt_card_type": first_rows['gt_card_type'].to_numpy(),
+        "gt_truth_type": first_rows['gt_truth_type'].to_numpy(),
+        "gt_libris_ID": first_rows['libris_ID'].to_numpy(),
+        "card_type": first_rows['card_type'].to_numpy(),
+        "match_stat": first_rows['match_stat'].to_numpy(),
         "matched_ID": matched_ID,
         "matched_similarity": matched_similarity,
-        "matched_IDs": ", ".join([str(id) if pd.notna(id) else '' for id in group.sort_values(by='similarity', ascending=False)['matched_ID']]),
-        "similarity_scores": ", ".join([f"{sim:.4f}" if pd.notna(sim) else '' for sim in group.sort_values(by='similarity', ascending=False)['similarity']]),
-        "correct_count": correct_count,
+        "matched_IDs": candidate_strings["matched_IDs"].to_numpy(),
+        "similarity_scores": candidate_strings["similarity_scores"].to_numpy(),
+        "correct_count": group_flags["correct_count"].where(has_candidates).to_numpy(),
         "result": result
     })
 
     return results
 
 def parse_gt_id_string(id_string):
-    # replace all semicolons with commas
-    id_string = str(id_string).replace(";", ",")
-    # split the string by commas
-    id_list = id_string.split(",")
-    # strip whitespace and filter out empty strings
-    id_list = [id.strip() for id in id_list if id.strip()]
-    return id_list
-
-def evaluate_match(row):
-    matched_id = row['matched_ID']
-    libris_id = row['libris_ID']
-    match_stat = row['match_stat']
-    truth_type = row['gt_truth_type']
-
-    if match_stat == "No match":
-        if truth_type == "no-match":
-            return "Correct"
-        else:
-            return "Incorrect"
-    elif match_stat == "No edition":
-        return "No edition"
-    else:
-        gt_id_list = parse_gt_id_string(libris_id)
-        # check if mathed_id is in the list of gt_ids
-        if matched_id in gt_id_list:
-            return "Correct"
-        else:
-            return "Incorrect"
+    # IDs are separated by commas or semicolons, found in a single scan of the string
+    return GT_ID_PATTERN.findall(str(id_string))
 
 def evaluate_card_completeness(match_results):    
     #If result for all match objects for a card is "correct", then the card is complete, else incomplete. Return only unique card_IDs with completeness status.
-    completeness_df = match_results.groupby("card_ID").apply(lambda g: pd.Series({
-        "box": g["box"].iloc[0],
-        "card": g["card"].iloc[0],
-        "card_type": g["card_type"].iloc[0],
-        "completeness": "Complete" if (g["match_stat"] == "Single").all() else "Incomplete"        
-    })).reset_index()
+    all_single = match_results["match_stat"].eq("Single").groupby(match_results["card_ID"]).all()
+
+    card_meta = match_results.drop_duplicates("card_ID").set_index("card_ID")[["box", "card", "card_type"]]
+    completeness_df = card_meta.join(all_single.map({True: "Complete", False: "Incomplete"}).rename("completeness")).sort_index().reset_index()
     
     return completeness_df
         
 def draw_histogram(data, ax=None):
 
-    correct = np.array(data["correct"]) 
-    incorrect = np.array(data["incorrect"])
+    correct = np.asarray(data["correct"]) 
+    incorrect = np.asarray(data["incorrect"])
 
     # Combine correct and incorrect to find global min and max
     score_min = min(correct.min(), incorrect.min())   
@@ -338,11 +392,9 @@ def draw_histogram(data, ax=None):
     bins = np.linspace(bin_min, bin_max, 40)
     bin_centers = (bins[:-1] + bins[1:]) / 2
 
-    ax.hist(correct, label='Correct', bins=bins, color="green", edgecolor='black', linewidth=0.5)
-    ax.hist(incorrect, label='Incorrect', bins=bins, color="red", edgecolor='black', linewidth=0.5, alpha=0.6)
-    
-    correct_counts, _ = np.histogram(correct, bins=bins)
-    incorrect_counts, _ = np.histogram(incorrect, bins=bins)    
+    # The bin counts drawn by hist are reused for the cumulative lines instead of binning the scores again
+    correct_counts, _, _ = ax.hist(correct, label='Correct', bins=bins, color="green", edgecolor='black', linewidth=0.5)
+    incorrect_counts, _, _ = ax.hist(incorrect, label='Incorrect', bins=bins, color="red", edgecolor='black', linewidth=0.5, alpha=0.6)
     total_counts = correct_counts + incorrect_counts
 
     ax.set_title(data["title"])
@@ -351,8 +403,7 @@ def draw_histogram(data, ax=None):
 
     ax2 = ax.twinx()
 
-    def reverse_cumulative_percent(values, bins, total=None):
-        counts, _ = np.histogram(values, bins=bins)
+    def reverse_cumulative_percent(counts, total=None):
         cumulative = np.cumsum(counts[::-1])[::-1]
         if total is not None:
             return 100 * cumulative / total
@@ -364,11 +415,11 @@ def draw_histogram(data, ax=None):
     
     # Plot reverse cumulative lines
     if data["cumulative_mode"] == "total":
-        correct_cumulative = reverse_cumulative_percent(correct, bins, total_cumulative[0])
-        incorrect_cumulative = reverse_cumulative_percent(incorrect, bins, total_cumulative[0])        
+        correct_cumulative = reverse_cumulative_percent(correct_counts, total_cumulative[0])
+        incorrect_cumulative = reverse_cumulative_percent(incorrect_counts, total_cumulative[0])        
     else:
-        correct_cumulative = reverse_cumulative_percent(correct, bins)    
-        incorrect_cumulative = reverse_cumulative_percent(incorrect, bins)
+        correct_cumulative = reverse_cumulative_percent(correct_counts)    
+        incorrect_cumulative = reverse_cumulative_percent(incorrect_counts)
     
     
     ax2.plot(bin_centers, correct_cumulative, color='darkgreen', linestyle='-', label='% ≥ score (Correct)')
@@ -403,12 +454,20 @@ def generate_pdf_report(similarity_scores_list, ouptput_directory, job_name):
 def generate_excel_report(evaluated_matches, match_results, evaluated_card_types, evaluated_extracted_occurences, evaluated_card_completeness, settings_path, output_directory, job_name):
     match_evaluation_report_filename = output_directory / str(job_name + "_report.xlsx")
 
-    with pd.ExcelWriter(match_evaluation_report_filename, engine="xlsxwriter") as writer:
+    # Checking every string cell for a URL is slow on the large sheets. The only URLs are the kortkat links,
+    # which are written as hyperlinks explicitly. constant_memory can't be used, since pandas writes the
+    # cells column by column and the statistics tables are placed side by side.
+    with pd.ExcelWriter(match_evaluation_report_filename, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}}) as writer:
         # Write entire matches_df to Excel
         evaluated_matches.to_excel(writer, sheet_name="Matches", index=False)
 
         # Write results to Excel
         match_results.to_excel(writer, sheet_name="Match results", index=False)
+
+        match_results_worksheet = writer.sheets["Match results"]
+        kortkat_url_column_index = match_results.columns.get_loc("kortkat_URL")
+        for row_index, kortkat_url in enumerate(match_results["kortkat_URL"], start=1):
+            match_results_worksheet.write_url(row_index, kortkat_url_column_index, kortkat_url)
         
         # Write match results statistics to Excel
         match_results_statistics_sheet_name = "Match results statistics"
@@ -425,28 +484,25 @@ def generate_excel_report(evaluated_matches, match_results, evaluated_card_types
         row_spacer = 2
         col_spacer = 3
 
-        max_table_height = 0
-        max_table_width = 0
+        # Count the results once per card type, box, match stat and result. The 'All' filters
+        # are sums over the card type and/or box levels of the same counts. Results without a card type
+        # or box are kept in the groups, so they are still counted in the 'All' tables.
+        counts = match_results.groupby(["card_type", "box", "match_stat", "result"], dropna=False).size()
+        counts = counts[counts.index.get_level_values("match_stat").notna() & counts.index.get_level_values("result").notna()]
+        counts_by_filter = {
+            (False, False): counts,
+            (True, False): counts.groupby(["box", "match_stat", "result"], dropna=False).sum(),
+            (False, True): counts.groupby(["card_type", "match_stat", "result"], dropna=False).sum(),
+            (True, True): counts.groupby(["match_stat", "result"], dropna=False).sum(),
+        }
+
+        # Every table is reindexed to all match stats and results, so they all have the same size
+        max_table_height = len(all_match_stats) + 1
+        max_table_width = len(all_results) + 1
 
         workbook = writer.book
         percent_format = workbook.add_format({'num_format': '0.00%'})
 
-        for card_filter in card_type_filters:
-            for box_filter in box_filters:
-                df_subset = match_results.copy()
-                
-                if card_filter != 'All':
-                    df_subset = df_subset[df_subset['card_type'] == card_filter]
-                
-                if box_filter != 'All':
-                    df_subset = df_subset[df_subset['box'] == box_filter]
-
-                if not df_subset.empty:
-                    pivot_table = df_subset.pivot_table(index="match_stat", columns="result", values="match_object_ID", aggfunc="count", fill_value=0)
-                    pivot_table = pivot_table.reindex(index=all_match_stats, columns=all_results, fill_value=0)
-                    max_table_height = max(max_table_height, pivot_table.shape[0] + 1)
-                    max_table_width = max(max_table_width, pivot_table.shape[1] + 1)
-
         static_row_step = max_table_height + 1 + row_spacer
         static_col_step = max_table_width + col_spacer
 
@@ -465,16 +521,18 @@ def generate_excel_report(evaluated_matches, match_results, evaluated_card_types
                 current_start_row = i * static_row_step
                 current_start_col = j * static_col_step
                 
-                df_subset = match_results.copy()
-                
-                if card_filter != 'All':
-                    df_subset = df_subset[df_subset['card_type'] == card_filter]
-                
-                if box_filter != 'All':
-                    df_subset = df_subset[df_subset['box'] == box_filter]
+                filter_counts = counts_by_filter[(card_filter == 'All', box_filter == 'All')]
+                filter_key = tuple(value for value in (card_filter, box_filter) if value != 'All')
 
-                if not df_subset.empty:
-                    pivot_table = df_subset.pivot_table(index="match_stat", columns="result", values="match_object_ID", aggfunc="count", fill_value=0)
+                if not filter_key:
+                    subset_counts = filter_counts
+                elif not pd.isna(list(filter_key)).any() and filter_key in filter_counts.index:
+                    subset_counts = filter_counts.loc[filter_key]
+                else:
+                    subset_counts = None
+
+                if subset_counts is not None:
+                    pivot_table = subset_counts.unstack("result", fill_value=0)
                 else:
                     pivot_table = pd.DataFrame({'Info': ['No Data']})
 
@@ -534,16 +592,15 @@ def generate_excel_report(evaluated_matches, match_results, evaluated_card_types
             # Convert the whole JSON to a pretty string
             json_str = json.dumps(settings, indent=2)
 
-            # Create a DataFrame with one row: "Settings" | JSON string
-            df = pd.DataFrame([["Settings:", json_str]])
-
-            # Write to a new sheet
-            df.to_excel(writer, sheet_name="Extraction and match settings", index=False, header=False)
+            # Write one row: "Settings" | JSON string, straight to a new sheet
+            settings_worksheet = workbook.add_worksheet("Extraction and match settings")
+            settings_worksheet.write_string(0, 0, "Settings:")
+            settings_worksheet.write_string(0, 1, json_str)
 
 def mm_to_inches(mm):
     return mm / 25.4
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Validate match run with known structure")
 
     # Main entry: match run directory (with known filenames)
@@ -560,7 +617,10 @@ def parse_args():
     parser.add_argument("--output_directory", type=Path, required=True, help="Directory to write reports to")
     parser.add_argument("--job_name", type=str, default=f"batch-job-{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}", help="Display name for batch job")
 
-    return parser.parse_args()
+    # Faster parsing of large workbooks, at the cost of the unused columns in the Matches sheet
+    parser.add_argument("--required_columns_only", action="store_true", help="Only read the columns the evaluation needs from the matches and ground truth files")
+
+    return parser.parse_args(argv)
 
 
 def resolve_paths(args):
@@ -597,24 +657,29 @@ def resolve_paths(args):
 
     return matches_path, settings_path, ground_truth_path, output_dir
 
-if __name__ == "__main__":
+def main(argv=None):
 
-    args = parse_args()
+    args = parse_args(argv)
     matches_path, settings_path, ground_truth_path, output_dir = resolve_paths(args)
 
-    matchresults_df, gt_df, merged_df = load_data(matches_path, ground_truth_path)
+    matchresults_df, gt_df, merged_df = load_data(matches_path, ground_truth_path, args.required_columns_only)
 
     evaluated_card_types = evaluate_extracted_card_types(matchresults_df, gt_df)
     evaluated_extracted_occurences = evaluate_extracted_occurences(matchresults_df, gt_df)
     
     if merged_df is not None and not merged_df.empty:        
-        # evaluated_matches, match_statistics = evaluate_matches(merged_df, output_dir)
-        evaluated_matches, match_results = evaluate_matches(merged_df, output_dir, args.job_name)
-        evaluated_card_completeness = evaluate_card_completeness(match_results)
-        generate_excel_report(evaluated_matches, match_results, evaluated_card_types, evaluated_extracted_occurences, evaluated_card_completeness, settings_path, output_dir, args.job_name)
+        # The PDF histograms are drawn in a separate process while the Excel report is written
+        with ProcessPoolExecutor(max_workers=1) as pdf_executor:
+            # evaluated_matches, match_statistics = evaluate_matches(merged_df, output_dir)
+            evaluated_matches, match_results, pdf_report = evaluate_matches(merged_df, output_dir, args.job_name, pdf_executor)
+            evaluated_card_completeness = evaluate_card_completeness(match_results)
+            generate_excel_report(evaluated_matches, match_results, evaluated_card_types, evaluated_extracted_occurences, evaluated_card_completeness, settings_path, output_dir, args.job_name)
+            pdf_report.result()
     else:
         print("No data to evaluate.")
 
     print("Done. Check the output directory for results.")
 
-    
+
+if __name__ == "__main__":
+    main()
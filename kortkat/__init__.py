@@ -1 +1,3 @@
-from .json_validation import validate_json
\ No newline at end of file
+from .json_validation import validate_json
+from .file_utils import cached_pickle_load, clone_file, clone_tree, fsync_directory, list_json_files, write_bytes, write_bytes_atomic
+from .config import cached_json_load, load_config
\ No newline at end of file
@@ -0,0 +1,42 @@
+import hashlib
+import json
+import marshal
+import os
+from pathlib import Path
+
+def cached_json_load(path, cache_directory):
+    # Large JSON files that are read on every run (like the YOLO reference lists) are kept in
+    # cache_directory as marshal blobs, which load faster than the JSON itself. There is one
+    # entry per source path, it records the modification time and size of the file and is
+    # overwritten when they change, so stale entries are never read and never pile up.
+    path = Path(path).resolve()
+    stat = path.stat()
+    source = (stat.st_mtime_ns, stat.st_size)
+    cache_file = Path(cache_directory) / f"{hashlib.sha1(str(path).encode('utf-8')).hexdigest()}.marshal"
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_source, data = marshal.load(f)
+        if cached_source == source:
+            return data
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    # The cache is only an optimization, a failed write is not an error
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, 'wb') as f:
+            marshal.dump((source, data), f)
+        os.replace(tmp_file, cache_file)
+    except (OSError, ValueError):
+        pass
+
+    return data
+
+def load_config(config_file):
+    with open(config_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
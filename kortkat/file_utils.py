@@ -0,0 +1,112 @@
+import fcntl
+import os
+import pickle
+import shutil
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# ioctl that makes dst share src's extents on copy-on-write filesystems (btrfs, xfs)
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+# Per-file copies are mostly syscall latency, so many can be in flight at once
+CLONE_TREE_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+def clone_file(src, dst):
+    # Same signature as shutil.copy2, so it can be used as copytree's copy_function.
+    # A clone costs the same regardless of file size and later writes to either file
+    # never show up in the other, unlike a hard link.
+    try:
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        shutil.copystat(src, dst)
+        return dst
+    except OSError:
+        # Filesystem without clone support or src and dst on different devices
+        return shutil.copy2(src, dst)
+
+def clone_tree(src, dst):
+    # Like shutil.copytree(src, dst, dirs_exist_ok=True, copy_function=clone_file),
+    # but the files are cloned from a thread pool instead of one after another
+    file_pairs = []
+    pending_directories = [(os.fspath(src), os.fspath(dst))]
+    while pending_directories:
+        src_directory, dst_directory = pending_directories.pop()
+        os.makedirs(dst_directory, exist_ok=True)
+        with os.scandir(src_directory) as entries:
+            for entry in entries:
+                dst_path = os.path.join(dst_directory, entry.name)
+                if entry.is_dir():
+                    pending_directories.append((entry.path, dst_path))
+                else:
+                    file_pairs.append((entry.path, dst_path))
+
+    with ThreadPoolExecutor(max_workers=CLONE_TREE_MAX_WORKERS) as executor:
+        list(executor.map(lambda pair: clone_file(*pair), file_pairs))
+
+    return dst
+
+def list_json_files(directory):
+    # The *.json files in directory as sorted paths, from a single scandir. The entry
+    # types come with the directory listing, so regular files need no extra stat.
+    directory = Path(directory)
+    with os.scandir(directory) as entries:
+        names = sorted(entry.name for entry in entries if entry.name.endswith('.json') and entry.is_file())
+    return [directory / name for name in names]
+
+def write_bytes(path, data):
+    # Write the whole buffer straight to a raw file descriptor, without the buffered
+    # file object in between, so a small file costs open, one write and close
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def write_bytes_atomic(path, data):
+    # Write the whole buffer to a temporary file next to path and rename it into place.
+    # A crash never leaves a half-written file, and the data goes out in one write call.
+    # The temporary name is per process, so processes rewriting the same file never
+    # write into each other's temporary file, the last complete rename wins.
+    tmp_path = f"{os.fspath(path)}.{os.getpid()}.tmp"
+    write_bytes(tmp_path, data)
+    os.replace(tmp_path, path)
+
+def fsync_directory(path):
+    # Flush the directory entries created by a batch of renames with one fsync,
+    # instead of paying for a metadata flush per file
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def cached_pickle_load(path, cache_path, load, version=None):
+    # load(path) is slow, so its result is pickled to cache_path and reused while path is
+    # unchanged. The cache records the modification time and size of path and is only read
+    # if both are equal, a copy that keeps an older modification time still replaces it.
+    # version names whatever the pickled data depends on (like the pandas version), a cache
+    # written under another version is not read.
+    stat = os.stat(path)
+    source = (stat.st_mtime_ns, stat.st_size, version)
+
+    # Unpickling a cache from another library version can raise almost anything,
+    # a cache that can't be read is loaded again from path
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if isinstance(cached, dict) and cached.get("source") == source:
+            return cached["data"]
+    except Exception:
+        pass
+
+    data = load(path)
+
+    # The cache is only an optimization, a failed write is not an error
+    try:
+        write_bytes_atomic(cache_path, pickle.dumps({"source": source, "data": data}, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        pass
+
+    return data
@@ -1,16 +1,32 @@
 import re
 
+# \u00XX escape of a control character, which indicates an unparsed unicode character.
+# Characters above \u001F are valid
+UNPARSED_UNICODE_PATTERN = re.compile(r'\\u00[0-1][0-9a-fA-F]')
+
+# HTML entities like &#xx;, which indicate unparsed HTML entities
+UNPARSED_HTML_ENTITY_PATTERN = re.compile(r'&#\d+;')
+
+# HTML entities with an escaped ampersand, \u0026#xx;
+ESCAPED_HTML_ENTITY_PATTERN = re.compile(r'\\u0026#\d+;')
+
 def validate_json(result_json):
+    if not isinstance(result_json, str):
+        return True
+
+    # Every pattern starts with one of these literals, most responses contain neither
+    if '\\u00' not in result_json and '&#' not in result_json:
+        return True
+
     # Invalid if \u00XX pattern exists in the JSON string, which indicates an unparsed unicode character
-    # Characters above \u001F are valid
-    if isinstance(result_json, str) and re.search(r'\\u00[0-1][0-9a-fA-F]', result_json):
+    if UNPARSED_UNICODE_PATTERN.search(result_json):
         return False
     
     # Invalid if HTML entities like &#xx; exist, which indicates unparsed HTML entities
-    if isinstance(result_json, str) and re.search(r'&#\d+;', result_json):
+    if UNPARSED_HTML_ENTITY_PATTERN.search(result_json):
         return False
     
-    if isinstance(result_json, str) and re.search(r'\\u0026#\d+;', result_json):
+    if ESCAPED_HTML_ENTITY_PATTERN.search(result_json):
         return False
 
     return True
\ No newline at end of file
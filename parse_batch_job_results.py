@@ -1,30 +1,107 @@
 from pathlib import Path
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 import json
+import os
 import time
 import kortkat
+import orjson
+
+# Number of results read from the stream and handed to the process pool at a time
+PARSE_BATCH_SIZE = 512
+
+# Number of results sent to a worker process in one message
+PARSE_CHUNK_SIZE = 16
 
 
 def load_batch_job_results(batch_job_result_dir, verbose=False):
 
     batch_job_results_file_path = batch_job_result_dir / "batch_job_result.jsonl"
 
+    # The file is opened here, so a missing file is still reported before any result is parsed
     try:
-        with open(batch_job_results_file_path, 'r', encoding='utf-8') as f:
-            # Use a list comprehension for a clean, one-line solution
-            return [json.loads(line) for line in f]
+        f = open(batch_job_results_file_path, 'rb')
     except FileNotFoundError:
         if verbose:
             print(f"Error: The file '{batch_job_results_file_path}' was not found.")
         return None
-    except json.JSONDecodeError as e:
-        if verbose:
-            print(f"Error decoding JSON on a line: {e}")
-        return []
     except Exception as e:
         if verbose:
             print(f"An error occurred: {e}")
-        return []    
+        return []
+
+    return read_batch_job_results(f, verbose)
+
+
+def read_batch_job_results(f, verbose=False):
+    # Yield the results one line at a time, so only one result is held in memory.
+    # A line that can't be decoded yields None, so it is counted in the parse report
+    # and the results after it are still parsed.
+    line_number = 0
+    with f:
+        try:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError as e:
+                    print(f"❌ Error decoding JSON on line {line_number}: {e}")
+                    yield None
+        except Exception as e:
+            print(f"❌ An error occurred after line {line_number}, the rest of the file is not parsed: {e}")
+
+def parse_batch_job_result(result, success_directory, fail_directory, verbose):
+    # Runs in a worker process. Returns the outcome, the token counts and the message to print,
+    # the counting and printing is done by the main process.
+    # The directories are plain strings, only the path of the file that is written gets built.
+    key = result.get('key', 'unknown_key')
+    message = None
+    
+    # Safely navigate the JSON structure, result['response']['candidates'][0]['content']['parts'][0]['text']
+    response = result.get("response", {})
+    candidates = response.get("candidates")
+    
+    if candidates and len(candidates) > 0:
+        # If candidates list exists and is not empty, get the text
+        result_json = candidates[0].get('content', {}).get('parts', [{}])[0].get('text')
+        if result_json:
+            try:
+                if not kortkat.validate_json(result_json):
+                    raise ValueError("Invalid JSON detected based on validation rules.")
+                result_json = orjson.loads(result_json)
+                output_json_file_path = f"{success_directory}/{key}.json"
+                kortkat.write_bytes(output_json_file_path, orjson.dumps(result_json, option=orjson.OPT_INDENT_2))
+                outcome = "saved"
+                if verbose:
+                    message = f"✅ Saved parsed result to {output_json_file_path}"
+            except Exception as e:
+                outcome = "parse_error"
+                kortkat.write_bytes(f"{fail_directory}/{key}_parse_error.json", result_json.encode('utf-8'))
+                if verbose:
+                    message = f"❌ Error saving parsed result for key {key}: {e}"
+        else:
+            outcome = "model_error"
+            kortkat.write_bytes(f"{fail_directory}/{key}_model_error.json", orjson.dumps(result, option=orjson.OPT_INDENT_2))
+            if verbose:
+                message = f"❌ Error saving parsed result for key {key}: Model generated no response"
+    else:
+        # Handle cases where there are no candidates
+        outcome = "api_error"
+        kortkat.write_bytes(f"{fail_directory}/{key}_api_error.json", orjson.dumps(result, option=orjson.OPT_INDENT_2))
+        if verbose:
+            message = f"🚫 BLOCKED/ERROR No candidates found."
+
+    usage_metadata = response.get("usageMetadata", {})
+    token_counts = (
+        usage_metadata.get("candidatesTokenCount", 0),
+        usage_metadata.get("promptTokenCount", 0),
+        usage_metadata.get("thoughtsTokenCount", 0),
+        usage_metadata.get("totalTokenCount", 0),
+        usage_metadata.get("cachedContentTokenCount", 0),
+    )
+
+    return outcome, token_counts, message
+
 
 def parse_batch_job_results(batch_job_results, output_directory, verbose):
     output_directory.mkdir(parents=True, exist_ok=True)
@@ -37,71 +114,49 @@ def parse_batch_job_results(batch_job_results, output_directory, verbose):
     total_tokens = 0
     total_cached_tokens = 0
 
-    number_of_results = len(batch_job_results)
+    number_of_results = 0
     number_of_saved_jsons = 0    
     number_of_parse_errors = 0
     number_of_model_errors = 0
     number_of_api_errors = 0
+    number_of_unreadable_lines = 0
 
     markdown_parse_report_file_path = output_directory / f"parse_report.md"
     json_parse_report_file_path = output_directory / f"parse_report.json"
     
-    for result in batch_job_results:
-        key = result.get('key', 'unknown_key')
-        output_json_file_path = output_directory / "success" / f"{key}.json"
-        parse_error_file_path = output_directory / "fail" / f"{key}_parse_error.json"
-        model_error_file_path = output_directory / "fail" / f"{key}_model_error.json"
-        api_error_file_path = output_directory / "fail" / f"{key}_api_error.json"
-        
-        # Safely navigate the JSON structure, result['response']['candidates'][0]['content']['parts'][0]['text']
-        response = result.get("response", {})
-        candidates = response.get("candidates")
-        
-        if candidates and len(candidates) > 0:
-            # If candidates list exists and is not empty, get the text
-            result_json = candidates[0].get('content', {}).get('parts', [{}])[0].get('text')
-            if result_json:
-                try:
-                    if not kortkat.validate_json(result_json):
-                        raise ValueError("Invalid JSON detected based on validation rules.")
-                    result_json = json.loads(result_json)
-                    with open(output_json_file_path, 'w', encoding='utf-8') as fp:
-                        json.dump(result_json, fp, indent=4)
+    success_directory = os.fspath(output_directory / "success")
+    fail_directory = os.fspath(output_directory / "fail")
+
+    # Results are handed to the worker processes a batch at a time, so the stream is never read in full
+    with ProcessPoolExecutor() as executor:
+        for batch in itertools.batched(batch_job_results, PARSE_BATCH_SIZE):
+            # Messages are printed once per batch instead of once per result
+            messages = []
+            results = [result for result in batch if result is not None]
+            number_of_unreadable_lines += len(batch) - len(results)
+            for outcome, token_counts, message in executor.map(parse_batch_job_result, results, itertools.repeat(success_directory), itertools.repeat(fail_directory), itertools.repeat(verbose), chunksize=PARSE_CHUNK_SIZE):
+                number_of_results += 1
+                if outcome == "saved":
                     number_of_saved_jsons += 1
-                    if verbose:
-                        print(f"✅ Saved parsed result to {output_json_file_path}")
-                except Exception as e:
+                elif outcome == "parse_error":
                     number_of_parse_errors += 1
-                    with open(parse_error_file_path, 'w', encoding='utf-8') as fp:
-                        fp.write(result_json)
-                    if verbose:
-                        print(f"❌ Error saving parsed result for key {key}: {e}")
-            else:
-                number_of_model_errors += 1
-                with open(model_error_file_path, 'w', encoding='utf-8') as fp:
-                        json.dump(result, fp, indent=4)
-                if verbose:
-                    print(f"❌ Error saving parsed result for key {key}: Model generated no response")
-        else:
-            # Handle cases where there are no candidates
-            number_of_api_errors += 1
-            with open(api_error_file_path, 'w', encoding='utf-8') as fp:
-                json.dump(result, fp, indent=4)
-            if verbose:
-                print(f"🚫 BLOCKED/ERROR No candidates found.")
-
-        usage_metadata = response.get("usageMetadata", {})
-        candidates_token_count = usage_metadata.get("candidatesTokenCount", 0)
-        prompt_token_count = usage_metadata.get("promptTokenCount", 0)
-        thoughts_token_count = usage_metadata.get("thoughtsTokenCount", 0)
-        total_token_count = usage_metadata.get("totalTokenCount", 0)
-        cached_token_count = usage_metadata.get("cachedContentTokenCount", 0)
-
-        total_candidate_tokens += candidates_token_count
-        total_prompt_tokens += prompt_token_count
-        total_thoughts_tokens += thoughts_token_count
-        total_tokens += total_token_count
-        total_cached_tokens += cached_token_count
+                elif outcome == "model_error":
+                    number_of_model_errors += 1
+                else:
+                    number_of_api_errors += 1
+
+                if message:
+                    messages.append(message)
+
+                candidates_token_count, prompt_token_count, thoughts_token_count, total_token_count, cached_token_count = token_counts
+                total_candidate_tokens += candidates_token_count
+                total_prompt_tokens += prompt_token_count
+                total_thoughts_tokens += thoughts_token_count
+                total_tokens += total_token_count
+                total_cached_tokens += cached_token_count
+
+            if messages:
+                print("\n".join(messages))
     
     mean_candidate_tokens = round(total_candidate_tokens / number_of_results) if number_of_results > 0 else 0
     mean_prompt_tokens = round(total_prompt_tokens / number_of_results) if number_of_results > 0 else 0
@@ -119,6 +174,7 @@ def parse_batch_job_results(batch_job_results, output_directory, verbose):
 | Number of parse errors: | {number_of_parse_errors} |
 | Number of model errors: | {number_of_model_errors} |
 | Number of API errors: | {number_of_api_errors} |
+| Number of unreadable result lines: | {number_of_unreadable_lines} |
 
 # Token count
 | Category | Total | Mean |
@@ -138,6 +194,7 @@ def parse_batch_job_results(batch_job_results, output_directory, verbose):
         "parse_errors": number_of_parse_errors,
         "model_errors": number_of_model_errors,
         "api_errors": number_of_api_errors,
+        "unreadable_lines": number_of_unreadable_lines,
         "token_count": {
             "input_tokens": {
                 "total": total_prompt_tokens,
@@ -168,7 +225,8 @@ def parse_batch_job_results(batch_job_results, output_directory, verbose):
     print(f"Number of saved JSONs: {number_of_saved_jsons}")
     print(f"Number of parse errors: {number_of_parse_errors}")
     print(f"Number of model errors: {number_of_model_errors}")
-    print(f"Number of API errors: {number_of_api_errors}\n")
+    print(f"Number of API errors: {number_of_api_errors}")
+    print(f"Number of unreadable result lines: {number_of_unreadable_lines}\n")
     print("Token count:")
     print(f"{"Category":<20} {"Total":<10} {"Mean":<15}")
     print("-" * 45)    
@@ -179,14 +237,14 @@ def parse_batch_job_results(batch_job_results, output_directory, verbose):
     print(f"{'Cached tokens':<20} {total_cached_tokens:<10} {mean_cached_tokens:<15}")
 
 
-if __name__ == "__main__":
+def main(argv=None):
     
     parser = argparse.ArgumentParser(description='Parse batch job results JSONL file into separate JSON files')
     parser.add_argument('input_directory', type=Path, help='Path to the directory with the batch input file')
     parser.add_argument('output_directory', type=Path, help='Path to where to put the json output')
     parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     batch_job_results = None
 
@@ -195,4 +253,8 @@ if __name__ == "__main__":
          if batch_job_results is None:
              time.sleep(60)
 
-    parse_batch_job_results(batch_job_results , args.output_directory, args.verbose)
\ No newline at end of file
+    parse_batch_job_results(batch_job_results , args.output_directory, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
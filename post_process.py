@@ -1,21 +1,32 @@
 import argparse
+import contextlib
+import importlib
+import io
 import subprocess
 import sys
-import json
 import os
 from pathlib import Path
-import shutil
-
-
-def load_config(config_file):
-    with open(config_file, 'r') as f:
-        config = json.load(f)
-    return config
+import kortkat
 
 def run_process_step(step_name, pipeline_directory, config_file, processing_directory):
     print(f"Running post-process step: {step_name}")
-    
-    command = [sys.executable, f"{step_name}.py", pipeline_directory, config_file, processing_directory]
+
+    step_arguments = [str(pipeline_directory), str(config_file), str(processing_directory)]
+
+    # Run the step's main() in this interpreter, which saves starting Python and importing the
+    # dependencies again for every step. Imported modules stay in sys.modules for the next run.
+    try:
+        step_module = importlib.import_module(step_name)
+    except ImportError:
+        step_module = None
+
+    if step_module is not None and hasattr(step_module, "main"):
+        # The step output was captured and dropped when it ran as a subprocess, keep it that way
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            step_module.main(step_arguments)
+        return
+
+    command = [sys.executable, f"{step_name}.py", *step_arguments]
     
     subprocess.run(
         command,
@@ -24,18 +35,18 @@ def run_process_step(step_name, pipeline_directory, config_file, processing_dire
         text=True
     )
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Update publication_type in JSON files for referenced cards.")
     parser.add_argument("pipeline_directory", type=Path, help="Directory containing the pipeline")
     parser.add_argument("config_file", type=Path, help="Path to pipeline config file (config.json)")
     parser.add_argument("input_directory", type=Path, help="Directory containing JSON files to enrich")
     parser.add_argument("output_directory", type=Path, help="Directory to save enriched JSON files")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parse_arguments()
+def main(argv=None):
+    args = parse_arguments(argv)
 
     pipeline_directory = args.pipeline_directory
     config_file = args.config_file
@@ -44,12 +55,14 @@ def main():
 
     os.makedirs(output_dir, exist_ok=True)
 
-    post_process_steps = load_config(config_file).get("post_process_steps", [])
+    post_process_steps = kortkat.load_config(config_file).get("post_process_steps", [])
 
    
     print(f"Copying JSON files from {input_dir}")
     try:
-        shutil.copytree(input_dir, output_dir, dirs_exist_ok=True)
+        # Clone instead of copying bytes where the filesystem allows it, the steps
+        # below rewrite files in place so hard links to the input are not an option
+        kortkat.clone_tree(input_dir, output_dir)
         print("Directory copied successfully!")
     except Exception as e:
         print(f"Error copying directory: {e}")
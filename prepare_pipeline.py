@@ -1,7 +1,7 @@
 from pathlib import Path
 import argparse
 import json
-import shutil
+import kortkat
 
 if __name__ == "__main__":
     
@@ -64,7 +64,8 @@ if __name__ == "__main__":
     failed_copies = []
     for source_path, dest_path in files_to_copy:
         try:
-            shutil.copy2(source_path, dest_path)
+            # Cloned on copy-on-write filesystems, so even a large gt.xlsx is copied without moving its data
+            kortkat.clone_file(source_path, Path(dest_path) / Path(source_path).name)
             print(f"✅ Successfully copied: {source_path}")
         except Exception as e:
             # If an error occurs, log it and continue
@@ -1,15 +1,26 @@
 from pathlib import Path
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
 import os
+import random
+import time
 from dotenv import load_dotenv
 import kortkat
+import orjson
+from pydantic import TypeAdapter
+from create_batch_input_file import load_pydantic_class_from_file
 
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 MODEL = "gemini-3-flash-preview"
 
+# Requests are sent from a pool of threads, so the API round-trips overlap
+MAX_WORKERS = 16
+
+# Upper limit of the wait between retries of a failed request
+MAX_BACKOFF_SECONDS = 60
+
 
 def log_error(filename, msg):
 
@@ -18,24 +29,27 @@ def log_error(filename, msg):
 
 
 def generate_content(client, generation_config, contents, model_error_filename, retries=10):
-    try:
-        result = client.models.generate_content(
-            model = MODEL,
-            contents=contents,
-            config=generation_config
-        )
-        return result
-    except Exception as e:
-        if retries <= 0:
-            log_error(model_error_filename, str(e))        
-            print(e)
-            return False
-        else:
-            print("Retrying...")
-            return generate_content(client, generation_config, contents, model_error_filename, retries-1)
-
-
-def process_request(request, output_directory):    
+    for attempt in range(retries + 1):
+        try:
+            result = client.models.generate_content(
+                model = MODEL,
+                contents=contents,
+                config=generation_config
+            )
+            return result
+        except Exception as e:
+            if attempt == retries:
+                log_error(model_error_filename, str(e))        
+                print(e)
+                return False
+
+            # Back off exponentially with some jitter, so retries from the worker threads spread out
+            delay = min(MAX_BACKOFF_SECONDS, 2 ** attempt) + random.uniform(0, 1)
+            print(f"Retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def process_request(request, output_directory, client=None, schema_adapter=None):    
     generation_config = request["request"]["generationConfig"]
     generation_config["system_instruction"] = request["request"]["systemInstruction"]["parts"][0]["text"]
     contents = request["request"]["contents"]
@@ -44,7 +58,8 @@ def process_request(request, output_directory):
     (output_directory / "success").mkdir(parents=True, exist_ok=True)
     (output_directory / "fail").mkdir(parents=True, exist_ok=True)
 
-    client = genai.Client(api_key=API_KEY)
+    if client is None:
+        client = genai.Client(api_key=API_KEY)
 
     json_filename = output_directory / "success" / f"{request['key']}.json"
     parse_error_filename = output_directory / "fail" / f"{request['key']}_parse_error.json"
@@ -61,9 +76,12 @@ def process_request(request, output_directory):
             log_error(parse_error_filename, result)
             print(f"❌ Failed: {request['key']}")
             return False
-        json_object = json.loads(result.text)        
-        with open(json_filename, 'w') as fp:
-            json.dump(json_object, fp, indent=4)
+        # Optionally check the output against the structured output schema. validate_json parses
+        # and validates in one go in pydantic-core, a card that does not fit counts as a parse error.
+        if schema_adapter is not None:
+            schema_adapter.validate_json(result.text)
+        json_object = orjson.loads(result.text)        
+        kortkat.write_bytes(json_filename, orjson.dumps(json_object, option=orjson.OPT_INDENT_2))
 
         print(f"✅ Success: {request['key']}")    
         return result
@@ -73,31 +91,42 @@ def process_request(request, output_directory):
         return False
 
 
-def process_requests(filtered_requests_input, output_directory):
-    for request in filtered_requests_input:
-        process_request(request, output_directory)
+def load_schema_adapter(schema_file: Path):
+    # The validator is built once and shared by all worker threads
+    schema_class = load_pydantic_class_from_file(schema_file.parent, schema_file.name, "StructuredOutputSchema")
+    return TypeAdapter(schema_class)
+
+
+def process_requests(filtered_requests_input, output_directory, schema_adapter=None):
+    # One client, and its connection pool, is shared by all worker threads
+    client = genai.Client(api_key=API_KEY)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # list() waits for all requests and raises any unexpected error from a worker
+        list(executor.map(lambda request: process_request(request, output_directory, client, schema_adapter), filtered_requests_input))
 
 
 def filter_requests_input(batch_job_input, keys_to_include, keys_to_exclude):
 
-    # IF length of keys_to_include is greater than 0, use it as the filtered_request_keys, otherwise use all keys from batch_job_input
+    # Keys are looked up once per request, keep them in sets
+    excluded_keys = set(keys_to_exclude)
+
+    # IF length of keys_to_include is greater than 0, only keep those keys, otherwise keep all keys from batch_job_input.
+    # Either way the requests are filtered in a single pass.
     if len(keys_to_include) > 0:
-        filtered_request_keys = keys_to_include
+        included_keys = set(keys_to_include) - excluded_keys
+        filtered_requests_input = [request for request in batch_job_input if request["key"] in included_keys]
     else:
-        filtered_request_keys = [request["key"] for request in batch_job_input]
-
-    # Filter out keys that are in keys_to_exclude
-    filtered_request_keys = [key for key in filtered_request_keys if key not in keys_to_exclude]
-
-    filtered_requests_input = [request for request in batch_job_input if request["key"] in filtered_request_keys]
+        filtered_requests_input = [request for request in batch_job_input if request["key"] not in excluded_keys]
 
     return filtered_requests_input
 
 
 def load_batch_job_input(batch_job_input_directory: Path):
     batch_job_input_file_path = batch_job_input_directory / "batch_input_file.jsonl"
-    with open(batch_job_input_file_path, "r", encoding="utf-8") as fp:
-        batch_job_input = [json.loads(line) for line in fp]
+    # Kept as a list, the requests are scanned more than once when filtering
+    with open(batch_job_input_file_path, "rb") as fp:
+        batch_job_input = [orjson.loads(line) for line in fp]
 
     return batch_job_input
 
@@ -105,8 +134,10 @@ def load_batch_job_input(batch_job_input_directory: Path):
 def load_keys(directory: Path):
     keys = []
     if directory:
-        request_files = [f for f in sorted(directory.glob('*.json'))]
-        keys = ["_".join(f.stem.split("_")[:2]) for f in request_files]
+        # One directory scan, the keys only need the file names
+        with os.scandir(directory) as entries:
+            request_files = sorted(entry.name for entry in entries if entry.name.endswith('.json') and entry.is_file())
+        keys = ["_".join(name[:-5].split("_", 2)[:2]) for name in request_files]
 
     return keys
         
@@ -117,6 +148,7 @@ if __name__ == "__main__":
     parser.add_argument('output_directory', type=Path, help='Path to where to put the json output')
     parser.add_argument('-i', '--include_directory', type=Path, help='Path to directory with files to include in processing', default=None)
     parser.add_argument('-e', '--exclude_directory', type=Path, help='Path to directory with files to exclude from processing', default=None)
+    parser.add_argument('-s', '--schema_file', type=Path, help='Path to structured_output_schema.py, validate the output against its StructuredOutputSchema', default=None)
 
     args = parser.parse_args()
 
@@ -129,4 +161,6 @@ if __name__ == "__main__":
         print("⚠️  No requests to process after filtering. Exiting.")
         exit(0)
 
-    process_requests(filtered_requests_input, args.output_directory)
\ No newline at end of file
+    schema_adapter = load_schema_adapter(args.schema_file) if args.schema_file else None
+
+    process_requests(filtered_requests_input, args.output_directory, schema_adapter)
\ No newline at end of file
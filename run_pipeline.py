@@ -2,13 +2,40 @@ import os
 import subprocess
 import sys
 import argparse
+import hashlib
+import importlib
+import io
+import json
+import resource
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import MappingProxyType
 from pathlib import Path
-from contextlib import contextmanager
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from dotenv import load_dotenv
+import kortkat
 
 load_dotenv()
 MATCH_WORKING_DIR = os.getenv("MATCH_WORKING_DIR")
 
+# Steps that declare their inputs are skipped when the command, the step's source files and
+# the inputs are unchanged since the last successful run. The key of each step's last run is
+# kept in an index in the cache directory of the pipeline.
+CACHE_DIRECTORY_NAME = ".cache"
+CACHE_INDEX_FILE_NAME = "steps.json"
+
+# Files up to this size are hashed by content, larger ones (like the card images) by size and modification time
+CONTENT_HASH_MAX_BYTES = 1 << 20
+
+# Threads hashing the files of a step's inputs
+HASH_MAX_WORKERS = os.cpu_count() or 1
+
+# Every step that runs appends a line with its wall-clock time, peak memory and CPU time
+PROFILE_FILE_NAME = "pipeline_profile.txt"
+
 @contextmanager
 def change_dir(destination):
     """A context manager to safely and temporarily change the working directory."""
@@ -21,67 +48,287 @@ def change_dir(destination):
 
 
 
-def log_to_file(step_key, result, pipeline_args):
+def step_log_file(step_key, pipeline_args):
     log_dir = Path(f"{pipeline_args['pipeline_directory']}/logs")
     log_dir.mkdir(exist_ok=True)
-    log_file = log_dir / f"{step_key}.log"
+    return log_dir / f"{step_key}.log"
+
+
+class StepOutput(io.TextIOBase):
+    # Stands in for sys.stdout or sys.stderr while a Python step runs in this interpreter.
+    # The output still shows up as it is written, and a copy goes to the step log.
+    def __init__(self, stream, write_copy):
+        self.stream = stream
+        self.write_copy = write_copy
+
+    def write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+        self.write_copy(text)
+        return len(text)
+
+
+def run_module(command, step_key, pipeline_args, step_profile):
+    # Python steps with a main() are run in this interpreter instead of a new one, which saves
+    # starting Python and importing the step's dependencies. A failure is reported like a failed
+    # subprocess, so both kinds of steps share the error handling in run_pipeline.
+    step_module = importlib.import_module(Path(command[1]).stem)
+    log_file = step_log_file(step_key, pipeline_args)
+    stderr_parts = []
+    returncode = 0
+
     with open(log_file, "w") as f:
-        if result.stdout:
-            f.write("=== Standard Output ===\n")
-            f.write(result.stdout.strip() + "\n")
-        if result.stderr:
+        def write_stdout_copy(text):
+            # Flushed right away, worker processes forked by the step inherit the file
+            if f.tell() == 0:
+                f.write("=== Standard Output ===\n")
+            f.write(text)
+            f.flush()
+
+        with redirect_stdout(StepOutput(sys.stdout, write_stdout_copy)), redirect_stderr(StepOutput(sys.stderr, stderr_parts.append)):
+            try:
+                step_module.main(list(command[2:]))
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    returncode = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                returncode = 1
+
+        if stderr_parts:
+            f.write("=== Standard Error ===\n")
+            f.writelines(stderr_parts)
+
+    # The step shares this process, so only the high-water mark of the run so far is known
+    step_profile["peak_rss_kb"] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def is_python_step(script):
+    # A script in this directory that can be called with an argument list
+    if not os.path.isfile(script):
+        return False
+    try:
+        return hasattr(importlib.import_module(Path(script).stem), "main")
+    except Exception:
+        # Left to the subprocess, which reports the error like any failing step
+        return False
+
+
+def run_command(command, step_key, pipeline_args, step_profile):
+    # Forward the step's output as it arrives instead of holding all of it until the step ends,
+    # and write it to the step log on the way. Standard error is read by a second thread, so
+    # neither pipe can fill up and stall the step. Python steps are told not to buffer their output.
+    log_file = step_log_file(step_key, pipeline_args)
+    stderr_lines = []
+
+    def forward_stderr(stream):
+        for line in stream:
+            sys.stderr.write(line)
+            sys.stderr.flush()
+            stderr_lines.append(line)
+
+    with open(log_file, "w") as f, subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        env=os.environ | {"PYTHONUNBUFFERED": "1"}
+    ) as process:
+        stderr_reader = threading.Thread(target=forward_stderr, args=(process.stderr,))
+        stderr_reader.start()
+
+        for i, line in enumerate(process.stdout):
+            if i == 0:
+                f.write("=== Standard Output ===\n")
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            f.write(line)
+
+        stderr_reader.join()
+        if stderr_lines:
             f.write("=== Standard Error ===\n")
-            f.write(result.stderr.strip() + "\n")
+            f.writelines(stderr_lines)
+
+        # Reap the step here instead of in Popen, wait4 also returns the peak memory of the
+        # step and the processes it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        step_profile["peak_rss_kb"] = usage.ru_maxrss
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def cpu_seconds():
+    # User and system time of this process and of all child processes that have been waited for
+    return sum(usage.ru_utime + usage.ru_stime for usage in (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+def write_profile_line(pipeline_args, step_key, started, elapsed, cpu, step_profile, status):
+    profile_file = pipeline_args["pipeline_directory"] / PROFILE_FILE_NAME
+    write_header = not profile_file.exists()
+    with open(profile_file, "a", encoding="utf-8") as f:
+        if write_header:
+            f.write("started\tstep\telapsed_s\tpeak_rss_kb\tcpu_s\tstatus\n")
+        f.write(f"{started:%Y-%m-%d %H:%M:%S}\t{step_key}\t{elapsed:.3f}\t{step_profile.get("peak_rss_kb", "")}\t{cpu:.3f}\t{status}\n")
+
+
+def list_files(directory, relative_directory=""):
+    # Every file below directory with its path relative to it, in sorted order, from one scandir per directory
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        relative_path = os.path.join(relative_directory, entry.name)
+        if entry.is_dir():
+            yield from list_files(entry.path, relative_path)
+        else:
+            yield entry.path, relative_path
+
+
+def file_fingerprint(file_path):
+    # Runs in a worker thread, hashlib releases the GIL while it hashes the file
+    stat = os.stat(file_path)
+    if stat.st_size <= CONTENT_HASH_MAX_BYTES:
+        with open(file_path, "rb") as f:
+            return f"{stat.st_size}\0".encode() + hashlib.file_digest(f, "sha256").digest()
+    return f"{stat.st_size}\0{stat.st_mtime_ns}".encode()
+
+
+def hash_path(hasher, path):
+    # Feed a file or a whole directory tree into hasher. Names are relative to path and
+    # visited in sorted order, so the same content always gives the same hash.
+    path = os.fspath(path)
+    if os.path.isfile(path):
+        files = [(path, "")]
+    elif os.path.isdir(path):
+        files = list(list_files(path))
+    else:
+        hasher.update(b"missing\0")
+        return
+
+    # The files are hashed on all cores, and their fingerprints are combined in order
+    with ThreadPoolExecutor(max_workers=HASH_MAX_WORKERS) as executor:
+        fingerprints = executor.map(file_fingerprint, [file_path for file_path, _ in files])
+        for (_, relative_path), fingerprint in zip(files, fingerprints):
+            hasher.update(f"{relative_path}\0".encode() + fingerprint + b"\0")
+
+
+def step_cache_key(step):
+    # The command, the step's own source files and every declared input. Outputs of earlier
+    # steps are inputs of later ones, so a step that produced new output invalidates its successors.
+    hasher = hashlib.sha256()
+    hasher.update("\0".join(step["command"]).encode())
+    for path in step.get("sources", ()) + step["inputs"]:
+        hasher.update(f"\0{path}\0".encode())
+        hash_path(hasher, path)
+    return hasher.hexdigest()
+
+
+def step_outputs_exist(step):
+    # A cached step is only skipped if what it produced is still there
+    for path in step["outputs"]:
+        if path.is_dir():
+            if not any(path.iterdir()):
+                return False
+        elif not path.is_file():
+            return False
+    return True
+
+
+def load_step_cache(pipeline_args):
+    cache_index_file = pipeline_args["pipeline_directory"] / CACHE_DIRECTORY_NAME / CACHE_INDEX_FILE_NAME
+    try:
+        with open(cache_index_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_step_cache(pipeline_args, step_cache):
+    cache_directory = pipeline_args["pipeline_directory"] / CACHE_DIRECTORY_NAME
+    cache_directory.mkdir(exist_ok=True)
+    kortkat.write_bytes_atomic(cache_directory / CACHE_INDEX_FILE_NAME, json.dumps(step_cache, indent=2).encode())
+
+
+def load_job_config(config_file):
+    # Some inputs of the steps are paths set in the job config. A job without a config yet
+    # has no such inputs, the steps that need it fail when they run.
+    try:
+        return kortkat.load_config(config_file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def define_pipeline_steps(pipeline_args):
+    # The commands and paths of a run are built once, from the parsed arguments. The steps are
+    # frozen so nothing changes them between the cache key and the command that is run.
+    pipeline_directory = pipeline_args["pipeline_directory"]
+    input_directory = pipeline_args["input_directory"]
+    extract_directory = pipeline_directory / "extract"
+    config_file = pipeline_directory / "config.json"
+    config_data = load_job_config(config_file)
+
+    # Resolved the same way as in enrich_with_yolo.py
+    yolo_data_path = config_data.get("post_process_arguments", {}).get("enrich_with_yolo", {}).get("yolo_data_path")
+    yolo_inputs = (Path(pipeline_directory / yolo_data_path).resolve(),) if yolo_data_path else ()
 
+    # The dataset the matcher reads. A relative path is relative to the matcher's working
+    # directory, where the cache key of the step is computed.
+    dataset_path = config_data.get("matching_config", {}).get("dataset_path")
+    dataset_inputs = (Path(dataset_path),) if dataset_path else ()
 
-def define_pipeline_steps():
     standard_pipeline_steps = [
         {
             "key":  "create-input",
             "name": "Create batch input file",
             # python3 create_batch_input_file.py [input_directory] [output_directory] [pipeline_directory] --start_index [start_image_number] --end_index [end_image_number]
-            "command": (
-                lambda args: [sys.executable, "create_batch_input_file.py", str(args["input_directory"]), str(args["pipeline_directory"]) + "/extract", str(args["pipeline_directory"])]
-            )
+            "command": (sys.executable, "create_batch_input_file.py", str(input_directory), str(extract_directory), str(pipeline_directory)),
+            "sources": ("create_batch_input_file.py",),
+            "inputs": (input_directory, config_file, pipeline_directory / "structured_output_schema.py"),
+            "outputs": (extract_directory / "batch_input_file.jsonl",)
         },
         {
             "key": "create-job",
             "name": "Create batch job",
             # python3 create_batch_job.py [input_] [output_directory] [pipeline_directory]
-            "command": (
-                lambda args: [sys.executable, "create_batch_job.py", str(args["pipeline_directory"]) + "/extract/batch_input_file.jsonl", str(args["pipeline_directory"]) + "/extract", str(args["pipeline_directory"])]
-            )
+            "command": (sys.executable, "create_batch_job.py", str(extract_directory / "batch_input_file.jsonl"), str(extract_directory), str(pipeline_directory))
         },
         {
             "key": "check-job",
             "name": "Check batch job",
             # python3 check_batch_job.py [batch_job_info_file] [output_directory]
-            "command": (
-                lambda args: [sys.executable, "check_batch_job.py", str(args["pipeline_directory"]) + "/extract/batch_job_info.json", str(args["pipeline_directory"]) + "/extract/batch_input_file_info.json", str(args["pipeline_directory"]) + "/extract"]
-            )
+            "command": (sys.executable, "check_batch_job.py", str(extract_directory / "batch_job_info.json"), str(extract_directory / "batch_input_file_info.json"), str(extract_directory))
         },
         {   "key": "parse",
             "name": "Parse batch job results",
             # python3 parse_batch_job_results.py [input_directory] [output_directory]
-            "command": (
-                lambda args: [sys.executable, "parse_batch_job_results.py", str(args["pipeline_directory"]) + "/extract/", str(args["pipeline_directory"]) + "/parse"]
-            )
+            "command": (sys.executable, "parse_batch_job_results.py", str(extract_directory), str(pipeline_directory / "parse")),
+            "sources": ("parse_batch_job_results.py", "kortkat"),
+            "inputs": (extract_directory / "batch_job_result.jsonl",),
+            "outputs": (pipeline_directory / "parse/parse_report.json",)
         },
         {
             "key": "post-process",
             "name": "Post-process parsed data",
             # python3 post_process.py [pipeline_directory] [config_file] [input_directory] [output_directory]
-            "command": (
-                lambda args: [sys.executable, "post_process.py", str(args["pipeline_directory"]), str(args["pipeline_directory"]) + "/config.json", str(args["pipeline_directory"]) + "/parse/success", str(args["pipeline_directory"]) + "/post-process"]
-            )
+            "command": (sys.executable, "post_process.py", str(pipeline_directory), str(config_file), str(pipeline_directory / "parse/success"), str(pipeline_directory / "post-process")),
+            "sources": ("post_process.py", "enrich_with_yolo.py", "transform_persons_to_authors.py", "transform_title_from_parts.py", "transform_postprocess.py", "kortkat"),
+            "inputs": (config_file, pipeline_directory / "parse/success") + yolo_inputs,
+            "outputs": (pipeline_directory / "post-process",)
         },
         {
             "key": "match",
             "name": "Match extracted data against dataset",
-            "command": (
-                lambda args: ["cargo", "run", "--release", "--", "-c", "match-json-zip", "-s", "libris-v1_7", "-i", str(args["pipeline_directory"]) + "/post-process", "-o", str(args["pipeline_directory"]) + "/match/outputfile.json", "-F", "json", "-C", str(args["pipeline_directory"]) + "/config.json"]
-            ),
-            "working_dir": MATCH_WORKING_DIR
+            "command": ("cargo", "run", "--release", "--", "-c", "match-json-zip", "-s", "libris-v1_7", "-i", str(pipeline_directory / "post-process"), "-o", str(pipeline_directory / "match/outputfile.json"), "-F", "json", "-C", str(config_file)),
+            "working_dir": MATCH_WORKING_DIR,
+            # Relative to the working directory, the matcher's own sources
+            "sources": ("src", "Cargo.toml", "Cargo.lock"),
+            "inputs": (config_file, pipeline_directory / "post-process") + dataset_inputs,
+            "outputs": (pipeline_directory / "match/outputfile.json",)
         }
     ]
 
@@ -90,66 +337,81 @@ def define_pipeline_steps():
             "key": "evaluate",
             "name": "Evaluate matches",
             # python3 generate_match_report.py --match_folder [match_folder] --matches_file [matches_file] --settings_file [settings_file] --ground_truth_file [groundtruth] --output_folder [output_folder] --job_name [job_name_string]
-            "command": (
-                lambda args: [sys.executable, "generate_match_report.py", "--match_directory", str(args["pipeline_directory"]) + "/match", "--ground_truth_file", str(args["pipeline_directory"]) + "/gt.xlsx", "--output_directory", str(args["pipeline_directory"]) + "/evaluate", "--job_name", args["pipeline_directory"].name]
-            )
+            "command": (sys.executable, "generate_match_report.py", "--match_directory", str(pipeline_directory / "match"), "--ground_truth_file", str(pipeline_directory / "gt.xlsx"), "--output_directory", str(pipeline_directory / "evaluate"), "--job_name", pipeline_directory.name),
+            "sources": ("generate_match_report.py",),
+            # The files, not the directories, the report caches parsed spreadsheets next to them
+            "inputs": (pipeline_directory / "match/outputfile.xlsx", pipeline_directory / "match/outputfile-report.json", pipeline_directory / "gt.xlsx"),
+            "outputs": (pipeline_directory / "evaluate",)
         }
     ]
 
-    return standard_pipeline_steps, extra_pipeline_steps
+    return [MappingProxyType(step) for step in standard_pipeline_steps], [MappingProxyType(step) for step in extra_pipeline_steps]
 
 
-def run_pipeline(pipeline_steps, pipeline_args, selected_steps):
+def run_pipeline(pipeline_steps, pipeline_args, selected_steps, use_cache=True, forced_steps=()):
     """
     Executes each step in the PIPELINE_STEPS list in order.
 
     If any step fails (returns a non-zero exit code), the pipeline
-    will stop and print the error.
+    will stop and print the error. Steps with unchanged inputs since
+    their last successful run are skipped, unless use_cache is False
+    or the step is one of forced_steps.
     """
 
     print("--- Starting Pipeline ---")
 
+    step_cache = load_step_cache(pipeline_args)
+
     for i, step in enumerate(pipeline_steps):
         if step["key"] in selected_steps:
             step_name = step["name"]
-            command = step["command"](pipeline_args)
+            command = step["command"]
             target_working_dir = step.get("working_dir", os.getcwd())
 
-            print(f"\n▶️  Running Step {i+1}: {step_name}")
-            print(f"    Command: {" ".join(command)}")
+            # The match step runs in the matcher's directory, which is only known from the environment
+            if not target_working_dir:
+                print(f"\n❌ ERROR: No working directory for step: {step_name}", file=sys.stderr)
+                print("    Check that MATCH_WORKING_DIR is set in the environment or .env file.", file=sys.stderr)
+                print("\n--- Pipeline halted due to an error ---", file=sys.stderr)
+                sys.exit(1)
 
             try:
-                if target_working_dir:
-                    with change_dir(target_working_dir):
-                        print(command)
-                        result = subprocess.run(
-                            command,
-                            check=True,
-                            capture_output=True,
-                            text=True
-                        )
-                        log_to_file(step_key=step["key"], result=result, pipeline_args=pipeline_args)
-                if result.stdout:                    
-                    print("    --- Output ---")
-                    print(result.stdout.strip())
-                    print("    --------------")
-
-                print(f"✅ Step Succeeded: {step_name}")
+                with change_dir(target_working_dir):
+                    # Steps that talk to the batch API declare no inputs and always run
+                    cache_key = step_cache_key(step) if "inputs" in step else None
+                    if use_cache and step["key"] not in forced_steps and cache_key is not None and step_cache.get(step["key"]) == cache_key and step_outputs_exist(step):
+                        print(f"\n⏭️  Skipping Step {i+1}: {step_name} (unchanged since last run)")
+                        continue
+
+                    print(f"\n▶️  Running Step {i+1}: {step_name}")
+                    print(f"    Command: {" ".join(command)}")
+                    print(command)
+                    # Profiled whether the step succeeds or not
+                    step_profile = {}
+                    status = "failed"
+                    started = datetime.now()
+                    start_time = time.perf_counter()
+                    start_cpu = cpu_seconds()
+                    try:
+                        if command[0] == sys.executable and is_python_step(command[1]):
+                            run_module(command, step["key"], pipeline_args, step_profile)
+                        else:
+                            run_command(command, step["key"], pipeline_args, step_profile)
+                        status = "ok"
+                    finally:
+                        elapsed = time.perf_counter() - start_time
+                        write_profile_line(pipeline_args, step["key"], started, elapsed, cpu_seconds() - start_cpu, step_profile, status)
+                    if cache_key is not None:
+                        step_cache[step["key"]] = cache_key
+                        save_step_cache(pipeline_args, step_cache)
+                    print(f"✅ Step Succeeded: {step_name} ({elapsed:.1f}s)")
 
             except subprocess.CalledProcessError as e:
                 # This block runs if the script returns a non-zero exit code
                 print(f"\n❌ ERROR: Step Failed: {step_name}", file=sys.stderr)
                 print(f"    Return Code: {e.returncode}", file=sys.stderr)
-
-                if e.stdout:
-                    print("    --- Standard Output ---", file=sys.stderr)
-                    print(e.stdout.strip(), file=sys.stderr)
-                    print("    -----------------------", file=sys.stderr)
-
-                if e.stderr:
-                    print("    --- Standard Error ---", file=sys.stderr)
-                    print(e.stderr.strip(), file=sys.stderr)
-                    print("    ----------------------", file=sys.stderr)
+                # The step's output has already been shown as it ran
+                print(f"    See the log in {pipeline_args['pipeline_directory']}/logs/{step['key']}.log", file=sys.stderr)
 
                 print("\n--- Pipeline halted due to an error ---", file=sys.stderr)
                 sys.exit(1) # Exit the orchestrator script with an error code
@@ -167,7 +429,22 @@ def run_pipeline(pipeline_steps, pipeline_args, selected_steps):
 
 if __name__ == "__main__":
 
-    standard_pipeline_steps, extra_pipeline_steps = define_pipeline_steps()
+    # The steps are built from the pipeline and input directory, so those are parsed first and
+    # the step choices are added once the steps are known. Without them the full parser below
+    # prints the usage or the error.
+    base_parser = argparse.ArgumentParser(add_help=False)
+    base_parser.add_argument("pipeline", type=Path, nargs="?")
+    base_parser.add_argument("input_directory", type=Path, nargs="?")
+    base_args, _ = base_parser.parse_known_args()
+
+    standard_pipeline_steps, extra_pipeline_steps = [], []
+    if base_args.pipeline and base_args.input_directory:
+        pipeline_args = {
+            "pipeline_directory": Path(f"jobs/{base_args.pipeline}").resolve(),
+            "input_directory": base_args.input_directory        
+        }
+        standard_pipeline_steps, extra_pipeline_steps = define_pipeline_steps(pipeline_args)
+
     pipeline_steps = standard_pipeline_steps + extra_pipeline_steps
     standard_step_keys = [step["key"] for step in standard_pipeline_steps]
     extra_step_keys = [step["key"] for step in extra_pipeline_steps]
@@ -176,18 +453,15 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run batch pipeline for processing, matching and evaluating library cards")
     parser.add_argument("pipeline", type=Path, help="Name of pipeline to run")
     parser.add_argument("input_directory", type=Path, help="Path to directory with images to process")
-    parser.add_argument("--steps", nargs="+", choices=standard_step_keys, help="Standard pipeline steps to run")
-    parser.add_argument("--extra-steps", nargs="+", choices=extra_step_keys, help="Optional extra pipeline steps to run")
+    parser.add_argument("--steps", nargs="+", choices=standard_step_keys or None, help="Standard pipeline steps to run")
+    parser.add_argument("--extra-steps", nargs="+", choices=extra_step_keys or None, help="Optional extra pipeline steps to run")
+    parser.add_argument("--no-cache", action="store_true", help="Run the selected steps even if their inputs are unchanged since the last run")
+    parser.add_argument("--force-steps", nargs="+", default=[], choices=(standard_step_keys + extra_step_keys) or None, help="Selected steps to run even if their inputs are unchanged since the last run")
 
     args = parser.parse_args()
 
-    pipeline_args = {
-        "pipeline_directory": Path(f"jobs/{args.pipeline}").resolve(),
-        "input_directory": args.input_directory        
-    }
-
     selected_steps = args.steps or standard_step_keys
     if args.extra_steps:
         selected_steps = list(dict.fromkeys(selected_steps + args.extra_steps))
 
-    run_pipeline(pipeline_steps, pipeline_args, selected_steps)
\ No newline at end of file
+    run_pipeline(pipeline_steps, pipeline_args, selected_steps, use_cache=not args.no_cache, forced_steps=args.force_steps)
@@ -0,0 +1,50 @@
+import pickle
+
+import pandas as pd
+
+from generate_match_report import read_excel_cached
+
+
+def write_ground_truth(path):
+    df = pd.DataFrame({"card_ID": ["c1", "c2"], "gt_entry_ID": ["e1", "e2"], "box": ["001", "002"]})
+    df.to_excel(path, index=False)
+    return df
+
+
+def test_corrupt_pickle_rereads_excel(tmp_path):
+    excel_path = tmp_path / "gt.xlsx"
+    expected = write_ground_truth(excel_path)
+    cache_path = excel_path.with_suffix(".report.pkl")
+    cache_path.write_bytes(b"\x80\x04not a pickle")
+
+    pd.testing.assert_frame_equal(read_excel_cached(excel_path), expected)
+
+    # The unreadable cache is replaced by one that is read on the next call
+    with open(cache_path, "rb") as f:
+        pd.testing.assert_frame_equal(pickle.load(f)["data"], expected)
+
+
+def test_incompatible_pickle_rereads_excel(tmp_path):
+    excel_path = tmp_path / "gt.xlsx"
+    expected = write_ground_truth(excel_path)
+
+    # Unpickling a DataFrame from another pandas version can fail with NotImplementedError
+    class Incompatible:
+        def __reduce__(self):
+            return (exec, ("raise NotImplementedError('incompatible pickle')",))
+
+    cache_path = excel_path.with_suffix(".report-columns.pkl")
+    cache_path.write_bytes(pickle.dumps(Incompatible()))
+
+    pd.testing.assert_frame_equal(read_excel_cached(excel_path, ["card_ID", "gt_entry_ID"]), expected[["card_ID", "gt_entry_ID"]])
+
+
+def test_pickle_from_other_pandas_version_is_not_read(tmp_path):
+    excel_path = tmp_path / "gt.xlsx"
+    expected = write_ground_truth(excel_path)
+    stat = excel_path.stat()
+    cache_path = excel_path.with_suffix(".report.pkl")
+    stale = pd.DataFrame({"card_ID": ["stale"]})
+    cache_path.write_bytes(pickle.dumps({"source": (stat.st_mtime_ns, stat.st_size, "0.0.0"), "data": stale}))
+
+    pd.testing.assert_frame_equal(read_excel_cached(excel_path), expected)
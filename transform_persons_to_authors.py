@@ -1,57 +1,88 @@
-import pandas as pd
 from pathlib import Path
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+import kortkat
+import orjson
 
-def process_directory(input_folder, output_folder):
+# Card files are independent of each other, so they are rewritten by a pool of threads.
+# orjson and the file reads and writes release the GIL, so the threads overlap.
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
-    # Create output directory
-    output_folder.mkdir(parents=True, exist_ok=True)
+def apply_authors(data):
+    # Set the author of a card from its main author and additional persons, returns whether the card changed
+    authors = []
 
-    # Loop over all files in the input folder    
-    json_files = [f for f in sorted(input_folder.glob('*.json'))]
+    if "main_author" in data and data["main_author"]:
+        authors.append(data["main_author"]["name"])
+
+    if "additional_persons" in data:
+        for person in data["additional_persons"]:
+            authors.append(person["name"])
+
+    author = " ".join(authors)
+    changed = data.get("author") != author
+    data["author"] = author
+    return changed
+
+
+def process_file(file, output_folder, json_option=0):
+    # Runs in a worker thread, the message to print is returned to the main thread
+    try:
+        with open(file, 'rb') as f:
+            data = orjson.loads(f.read())
+
+        changed = apply_authors(data)
 
-    for file in json_files:        
-        try:
-            with open(file, 'r', encoding='utf-8') as f: #Explicit encoding to handle various characters
-                data = json.load(f)
+        # When rewriting in place, a card that already has the right author is left untouched
+        output_file = output_folder / file.name
+        if output_file == file and not changed:
+            return None
 
-                authors = []
+        kortkat.write_bytes_atomic(output_file, orjson.dumps(data, option=json_option))
 
-                if "main_author" in data and data["main_author"]:
-                    authors.append(data["main_author"]["name"])
+    except FileNotFoundError:
+        return f"Error: File not found at {file}"
+    except orjson.JSONDecodeError:
+        return f"Error: Invalid JSON format in {file}"
+    except Exception as e: # Catch other potential errors
+        return f"An unexpected error occurred while processing {file}: {e}"
+
+
+def process_directory(input_folder, output_folder, pretty=False):
+
+    # Create output directory
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    # Loop over all files in the input folder    
+    json_files = kortkat.list_json_files(input_folder)
 
-                if "additional_persons" in data:
-                    for person in data["additional_persons"]:
-                        authors.append(person["name"])
+    # Compact JSON unless asked otherwise, the cards are read by the matcher, not by people
+    json_option = orjson.OPT_INDENT_2 if pretty else 0
 
-                data["author"] = " ".join(authors)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for message in executor.map(lambda file: process_file(file, output_folder, json_option), json_files):
+            if message:
+                print(message)
 
-            output_file = output_folder / file.name
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-                
-        except FileNotFoundError:
-            print(f"Error: File not found at {file}")
-        except json.JSONDecodeError:
-            print(f"Error: Invalid JSON format in {file}")
-        except Exception as e: # Catch other potential errors
-            print(f"An unexpected error occurred while processing {file}: {e}")
+    # All renames are done, make them durable together
+    kortkat.fsync_directory(output_folder)
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Update publication_type in JSON files for referenced cards.")
     parser.add_argument("pipeline_directory", type=Path, help="Directory containing the pipeline")
     parser.add_argument("config_file", type=Path, help="Path to pipeline config file (config.json)")
     parser.add_argument("processing_directory", type=Path, help="Directory containing JSON files to enrich")
     parser.add_argument("--schema-version", type=int, default=2, help="Schema version to use (default: 1)")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, for reading the cards while debugging")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
-def main():
-    args = parse_arguments()
+def main(argv=None):
+    args = parse_arguments(argv)
 
-    process_directory(args.processing_directory, args.processing_directory)
+    process_directory(args.processing_directory, args.processing_directory, args.pretty)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+from pathlib import Path
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import kortkat
+import orjson
+from transform_persons_to_authors import apply_authors
+from transform_title_from_parts import apply_title
+
+# Card files are independent of each other, so they are rewritten by a pool of threads.
+# orjson and the file reads and writes release the GIL, so the threads overlap.
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+def process_file(file, output_folder, parts_to_include, json_option=0):
+    # Runs in a worker thread, the messages to print are returned to the main thread.
+    # Does the work of transform_persons_to_authors and transform_title_from_parts with
+    # one read and one write of the card. A transform that fails does not stop the other.
+    messages = []
+    try:
+        with open(file, 'rb') as f:
+            data = orjson.loads(f.read())
+    except FileNotFoundError:
+        return [f"Error: File not found at {file}"]
+    except orjson.JSONDecodeError:
+        return [f"Error: Invalid JSON format in {file}"]
+    except Exception as e: # Catch other potential errors
+        return [f"An unexpected error occurred while processing {file}: {e}"]
+
+    changed = False
+    for transform in (apply_authors, lambda data: apply_title(data, parts_to_include)):
+        try:
+            changed = transform(data) or changed
+        except Exception as e:
+            messages.append(f"An unexpected error occurred while processing {file}: {e}")
+
+    # When rewriting in place, a card that already has the right author and title is left untouched
+    output_file = output_folder / file.name
+    if output_file != file or changed:
+        try:
+            kortkat.write_bytes_atomic(output_file, orjson.dumps(data, option=json_option))
+        except Exception as e:
+            messages.append(f"An unexpected error occurred while processing {file}: {e}")
+
+    return messages
+
+
+def process_directory(input_folder, output_folder, parts_to_include, pretty=False):
+
+    # Create output directory
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    # Loop over all files in the input folder    
+    json_files = kortkat.list_json_files(input_folder)
+
+    # Compact JSON unless asked otherwise, the cards are read by the matcher, not by people
+    json_option = orjson.OPT_INDENT_2 if pretty else 0
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for messages in executor.map(lambda file: process_file(file, output_folder, parts_to_include, json_option), json_files):
+            for message in messages:
+                print(message)
+
+    # All renames are done, make them durable together
+    kortkat.fsync_directory(output_folder)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Set author and title in JSON files from persons and title parts.")
+    parser.add_argument("pipeline_directory", type=Path, help="Directory containing the pipeline")
+    parser.add_argument("config_file", type=Path, help="Path to pipeline config file (config.json)")
+    parser.add_argument("processing_directory", type=Path, help="Directory containing JSON files to transform")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, for reading the cards while debugging")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    config_file = args.config_file
+    processing_directory = args.processing_directory
+
+    config_data = kortkat.load_config(config_file)
+
+    # Same arguments as when the title is set by transform_title_from_parts, so a config
+    # only has to change its list of post-process steps
+    processing_arguments = config_data.get("post_process_arguments", {}).get("transform_title_from_parts", {})
+    parts_to_include = processing_arguments.get("parts_to_include")
+
+    process_directory(processing_directory, processing_directory, parts_to_include, args.pretty)
+
+
+if __name__ == "__main__":
+    main()
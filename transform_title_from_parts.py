@@ -1,69 +1,87 @@
-import pandas as pd
 from pathlib import Path
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
+import os
+import kortkat
+import orjson
 
-def load_config(config_file):
-    with open(config_file, 'r') as f:
-        config = json.load(f)
-    return config
+# Card files are independent of each other, so they are rewritten by a pool of threads.
+# orjson and the file reads and writes release the GIL, so the threads overlap.
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
-def process_directory(input_folder, output_folder, parts_to_include):
+def apply_title(data, parts_to_include):
+    # Set the title of a card from the parts of its title statement, returns whether the card changed
+    full_title = " ".join(field for field in (data["title_statement"].get(part, "") for part in parts_to_include) if field)
+    changed = data.get("title") != full_title
+    data["title"] = full_title
+    return changed
+
+
+def process_file(file, output_folder, parts_to_include, json_option=0):
+    # Runs in a worker thread, the message to print is returned to the main thread
+    try:
+        with open(file, 'rb') as f:
+            data = orjson.loads(f.read())
+
+        changed = apply_title(data, parts_to_include)
+
+        # When rewriting in place, a card that already has the right title is left untouched
+        output_file = output_folder / file.name
+        if output_file == file and not changed:
+            return None
+
+        kortkat.write_bytes_atomic(output_file, orjson.dumps(data, option=json_option))
+
+    except FileNotFoundError:
+        return f"Error: File not found at {file}"
+    except orjson.JSONDecodeError:
+        return f"Error: Invalid JSON format in {file}"
+    except Exception as e: # Catch other potential errors
+        return f"An unexpected error occurred while processing {file}: {e}"
+
+
+def process_directory(input_folder, output_folder, parts_to_include, pretty=False):
     
     # Create output directory
     output_folder.mkdir(parents=True, exist_ok=True)
 
     # Loop over all files in the input folder    
-    json_files = [f for f in sorted(input_folder.glob('*.json'))]
-
-    for file in json_files:        
-        try:
-            with open(file, 'r', encoding='utf-8') as f: #Explicit encoding to handle various characters
-                data = json.load(f)
-
-                titles = []
-                fields_to_concatenate = []
+    json_files = kortkat.list_json_files(input_folder)
 
-                for part in parts_to_include:
-                    fields_to_concatenate.append(data["title_statement"].get(part, ""))
-                
-                full_title = " ".join([field for field in fields_to_concatenate if field])
-                data["title"] = full_title
+    # Compact JSON unless asked otherwise, the cards are read by the matcher, not by people
+    json_option = orjson.OPT_INDENT_2 if pretty else 0
 
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for message in executor.map(lambda file: process_file(file, output_folder, parts_to_include, json_option), json_files):
+            if message:
+                print(message)
 
-            output_file = output_folder / file.name
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-                
-        except FileNotFoundError:
-            print(f"Error: File not found at {file}")
-        except json.JSONDecodeError:
-            print(f"Error: Invalid JSON format in {file}")
-        except Exception as e: # Catch other potential errors
-            print(f"An unexpected error occurred while processing {file}: {e}")
+    # All renames are done, make them durable together
+    kortkat.fsync_directory(output_folder)
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Update publication_type in JSON files for referenced cards.")
     parser.add_argument("pipeline_directory", type=Path, help="Directory containing the pipeline")
     parser.add_argument("config_file", type=Path, help="Path to pipeline config file (config.json)")
     parser.add_argument("processing_directory", type=Path, help="Directory containing JSON files to enrich")
     parser.add_argument("--schema-version", type=int, default=2, help="Schema version to use (default: 1)")
+    parser.add_argument("--pretty", action="store_true", help="Write indented JSON, for reading the cards while debugging")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print detailed processing messages")
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
-def main():
-    args = parse_arguments()
+def main(argv=None):
+    args = parse_arguments(argv)
 
     config_file = args.config_file
     processing_directory = args.processing_directory
 
-    config_data = load_config(config_file)
+    config_data = kortkat.load_config(config_file)
 
     processing_arguments = config_data.get("post_process_arguments", {}).get("transform_title_from_parts", {})
     parts_to_include = processing_arguments.get("parts_to_include")
 
-    process_directory(processing_directory, processing_directory, parts_to_include)
+    process_directory(processing_directory, processing_directory, parts_to_include, args.pretty)
 
 
 if __name__ == "__main__":